@@ -0,0 +1,201 @@
+""" Benchmarks of the profitroll kernels and of a full time step.
+
+Every benchmark is run on the v_stripe_test case, on square grids of the sizes given
+(128 to 2048 points by default). For each benchmark and size, the script reports the median
+time of a call, the throughput in grid points per second and the peak memory allocated during
+a call (traced by tracemalloc, which sees the numpy arrays). The results are written in a
+JSON file with the commit and the machine, and can be compared with a previous results file:
+
+    python benchmarks/run_benchmarks.py --sizes 128 256 --output new.json --compare old.json
+
+The list of the benchmarks is given by --list, and --only selects the benchmarks whose
+name contains one of the given strings.
+"""
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime
+
+import numpy as np
+from netCDF4 import Dataset
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from profitroll.core.simulation import Simulation
+from profitroll.core.history import History
+from profitroll.core.state import State
+from profitroll.test.test_cases import v_stripe_test
+from profitroll.methods.pseudo_spectral_wind import pseudo_spectral_wind
+from profitroll.methods.wrap_advection_step_3P import wrap_advection_step_3P
+from profitroll.methods.wrap_wv import wrap_wv
+from profitroll.methods.end_pop import end_pop
+from profitroll.methods.advection_step_3P import advection_step_3P
+from profitroll.methods.upstream_interp import upstream_interp
+from profitroll.methods.spectral import geostwind, vertwind
+
+default_sizes = [128, 256, 512, 1024, 2048]
+interp_methods = ['nearest', 'linear', 'diffusive', 'bicubic']
+orders_alpha = [1, 2, 3]
+
+class Case():
+    """ Simulation of the v_stripe_test case on a square grid, advanced by one step so that every
+    variable of its history is computed, and the inputs of the kernels taken from it
+    """
+    def __init__(self, size, folder, options):
+        Lx, Ly, dt = 2048e3, 2048e3, 300
+        initial = os.path.join(folder, 'initial_{}.nc'.format(size))
+        initialCDF = v_stripe_test(initial, Lx, Ly, size, size, dt, 2, size//8, size//15, precision=options.precision)
+        kwargs = {'alpha_method': 'damped_bicubic', 'order_alpha': 2, 'F_method': 'damped_bicubic',
+                  'interp_backend': options.interp_backend}
+        self.simulation = Simulation(initialCDF, [pseudo_spectral_wind, wrap_advection_step_3P, wrap_wv, end_pop],
+                                     [{}, kwargs, dict(kwargs), {}], folder, name=str(size),
+                                     fft_backend=options.fft_backend, precision=options.precision)
+        self.simulation.forward()
+        self.initial = initial
+        self.backup = os.path.join(folder, 'backup_{}.nc'.format(size))
+        self.options = options
+        self.size = size
+        self.dt = dt
+
+        states = self.simulation.history.state_list
+        self.state = states[-1]
+        self.previous = states[-2]
+        self.grid = self.simulation.grid
+        self.params = self.simulation.params
+        self.alpha_u = self.previous.vrs['alpha_ut']
+        self.alpha_v = self.previous.vrs['alpha_vt']
+
+def interp_benchmark(method):
+    def setup(case):
+        field = case.state.vrs['theta_t']
+        return lambda: upstream_interp(case.alpha_u, case.alpha_v, field, method=method,
+                                       backend=case.options.interp_backend)
+    return setup
+
+def advection_benchmark(order_alpha):
+    def setup(case):
+        vrs = case.previous.vrs
+        return lambda: advection_step_3P(vrs['alpha_ut'], vrs['alpha_vt'], vrs['theta_t'], case.dt,
+                                         case.state.vrs['ut'], case.state.vrs['vt'], case.grid.dx, case.grid.dy,
+                                         'damped_bicubic', order_alpha, 'damped_bicubic',
+                                         interp_backend=case.options.interp_backend)
+    return setup
+
+def geostwind_benchmark(case):
+    fft = case.simulation.fft_backend
+    return lambda: geostwind(case.grid.Lx, case.grid.Ly, case.state.vrs['theta_t'], case.params,
+                             z=case.params['z_star'], backend=fft)
+
+def vertwind_benchmark(case):
+    fft = case.simulation.fft_backend
+    return lambda: vertwind(case.grid.Lx, case.grid.Ly, case.state.vrs['theta_t'], case.previous.vrs['theta_t'],
+                            case.dt, case.params, z=case.params['z_star'], backend=fft)
+
+def state_copy_benchmark(case):
+    return lambda: State.copy(case.state)
+
+def history_save_benchmark(case):
+    def run():
+        with Dataset(case.backup, 'r+') as handle:
+            case.simulation.history.save(handle, backup=True)
+    return run
+
+def history_fromcdf_benchmark(case):
+    def run():
+        with Dataset(case.initial, 'r') as handle:
+            return History.fromCDF(handle, dtype=case.options.precision)
+    return run
+
+def forward_benchmark(case):
+    return case.simulation.forward
+
+benchmarks = dict([('upstream_interp_' + method, interp_benchmark(method)) for method in interp_methods]
+                  + [('advection_step_3P_order{}'.format(order), advection_benchmark(order)) for order in orders_alpha]
+                  + [('geostwind', geostwind_benchmark), ('vertwind', vertwind_benchmark),
+                     ('State.copy', state_copy_benchmark), ('History.save', history_save_benchmark),
+                     ('History.fromCDF', history_fromcdf_benchmark), ('forward', forward_benchmark)])
+
+def measure(func, repeat):
+    """ Median and minimum time of func after a first (warm-up) call, and the peak memory allocated by a call
+    """
+    func()
+    times = []
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        func()
+        times.append(time.perf_counter() - t0)
+    # measured apart: tracing the allocations slows the calls down
+    tracemalloc.start()
+    func()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return float(np.median(times)), float(np.min(times)), peak
+
+def commit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', 'HEAD'], cwd=os.path.dirname(os.path.abspath(__file__)),
+                                       stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def compare(results, path):
+    """ Prints the ratio of the median times with the ones of a previous results file (above 1: slower)
+    """
+    with open(path) as handle:
+        content = json.load(handle)
+    previous = {(row['name'], row['size']): row for row in content['results']}
+    print('\nComparison with {} (commit {})'.format(path, content.get('commit')))
+    print('{:<30} {:>6} {:>10}'.format('benchmark', 'size', 'ratio'))
+    for row in results:
+        old = previous.get((row['name'], row['size']))
+        if old is not None:
+            print('{:<30} {:>6} {:>10.3f}'.format(row['name'], row['size'], row['median'] / old['median']))
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmarks of the profitroll kernels and of a full time step')
+    parser.add_argument('--sizes', type=int, nargs='+', default=default_sizes, help='sizes N of the N x N grids')
+    parser.add_argument('--repeat', type=int, default=5, help='number of timed calls of each benchmark')
+    parser.add_argument('--only', nargs='+', default=None, help='run the benchmarks whose name contains one of these strings')
+    parser.add_argument('--output', default='benchmark_results.json', help='JSON file where the results are written')
+    parser.add_argument('--compare', default=None, help='previous JSON results file to compare with')
+    parser.add_argument('--precision', default='float64', help="'float64' or 'float32'")
+    parser.add_argument('--fft-backend', default=None, help="'numpy', 'scipy' or 'pyfftw'")
+    parser.add_argument('--interp-backend', default='numpy', help="'numpy' or 'numba'")
+    parser.add_argument('--list', action='store_true', help='list the benchmarks and exit')
+    options = parser.parse_args()
+
+    if options.list:
+        print('\n'.join(benchmarks))
+        return
+    selected = [name for name in benchmarks if options.only is None or any(part in name for part in options.only)]
+
+    results = []
+    print('{:<30} {:>6} {:>12} {:>16} {:>14}'.format('benchmark', 'size', 'median (s)', 'points/s', 'peak memory (MB)'))
+    with tempfile.TemporaryDirectory() as folder:
+        for size in options.sizes:
+            case = Case(size, folder, options)
+            for name in selected:
+                median, best, peak = measure(benchmarks[name](case), options.repeat)
+                row = {'name': name, 'size': size, 'median': median, 'min': best,
+                       'throughput': size * size / median, 'peak_memory': peak}
+                results.append(row)
+                print('{:<30} {:>6} {:>12.5f} {:>16.3e} {:>14.1f}'.format(name, size, median, row['throughput'], peak / 2**20))
+            del case
+
+    with open(options.output, 'w') as handle:
+        json.dump({'commit': commit(), 'date': datetime.now().isoformat(), 'machine': platform.platform(),
+                   'processor': platform.processor(), 'python': platform.python_version(), 'numpy': np.__version__,
+                   'options': {'repeat': options.repeat, 'precision': options.precision,
+                               'fft_backend': options.fft_backend, 'interp_backend': options.interp_backend},
+                   'results': results}, handle, indent=1)
+    if options.compare is not None:
+        compare(results, options.compare)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,135 @@
+import json
+import os
+
+import numpy as np
+
+from .state import State
+from .tracing import traced
+
+# A checkpoint is a folder containing one .npy file per variable, holding the
+# (size, Nx, Ny) stack of the states of a history, and a manifest.json file
+# listing the times of the states and the files of the variables.
+# The files of a new checkpoint get a new generation number and the manifest
+# is replaced atomically (write-then-rename) once they are complete: a crash
+# while writing leaves the previous checkpoint readable.
+
+manifest_name = 'manifest.json'
+
+def read_manifest(path):
+    """ Reads the manifest of a checkpoint
+
+    :param path: Folder of the checkpoint
+    :type path: str
+    :return: The manifest (generation, times t of the states, variables)
+    :rtype: dictionary
+    """
+    with open(os.path.join(path, manifest_name)) as handle:
+        return json.load(handle)
+
+def write_checkpoint(path, states, generation=0):
+    """ Writes the given states in a checkpoint folder, replacing the previous checkpoint
+
+    :param path: Folder of the checkpoint (created if needed)
+    :type path: str
+    :param states: States to write, all with the same variables
+    :type states: list of :class:`State` objects
+    :param generation: Number of the checkpoint, which is part of the names of the files, defaults to 0
+    :type generation: int, optional
+    :return: The manifest written
+    :rtype: dictionary
+    """
+    os.makedirs(path, exist_ok=True)
+    variables = {}
+    for var, value in states[0].vrs.items():
+        if not isinstance(value, np.ndarray):
+            continue
+        name = '{}.{}.npy'.format(var, generation)
+        stack = np.lib.format.open_memmap(os.path.join(path, name), mode='w+', dtype=value.dtype,
+                                          shape=(len(states),) + value.shape)
+        for k, state in enumerate(states):
+            stack[k] = state.vrs[var]
+        stack.flush()
+        del stack
+        variables[var] = {'file': name, 'dtype': value.dtype.str, 'shape': list(value.shape)}
+
+    manifest = {'generation': generation, 't': [float(state.t) for state in states], 'variables': variables}
+    tmp = os.path.join(path, manifest_name + '.tmp')
+    with open(tmp, 'w') as handle:
+        json.dump(manifest, handle)
+        handle.flush()
+        os.fsync(handle.fileno())
+    os.replace(tmp, os.path.join(path, manifest_name))
+
+    # the files of the previous checkpoints are not needed anymore
+    current = {entry['file'] for entry in variables.values()}
+    for name in os.listdir(path):
+        if name.endswith('.npy') and name not in current:
+            os.remove(os.path.join(path, name))
+    return manifest
+
+def read_checkpoint(path, dtype=None, mmap_mode='c', variables=None):
+    """ Reads the states of a checkpoint. The files are memory-mapped: the variables of the states
+    are views on them and are read from the disk only when they are used.
+
+    :param path: Folder of the checkpoint
+    :type path: str
+    :param dtype: Floating point type of the variables, defaults to None (type of the files, no copy)
+    :type dtype: numpy dtype, optional
+    :param mmap_mode: Mode given to :func:`numpy.load`, defaults to 'c' (the arrays can be modified in memory, the files are left unchanged)
+    :type mmap_mode: str, optional
+    :param variables: list of the variables to read, defaults to None (all the variables of the checkpoint)
+    :type variables: list of str, optional
+    :return: The states, from the oldest to the newest
+    :rtype: list of :class:`State` objects
+    """
+    manifest = read_manifest(path)
+    stacks = {var: np.load(os.path.join(path, entry['file']), mmap_mode=mmap_mode)
+              for var, entry in manifest['variables'].items() if variables is None or var in variables}
+    states = []
+    for k, t in enumerate(manifest['t']):
+        state = State(t, dtype=dtype)
+        state.vrs.update({var: stack[k] for var, stack in stacks.items()})
+        states.append(state)
+    return states
+
+class CheckpointWriter():
+    """ This class encodes the checkpoint folder where the backups of a run are written
+    (see :func:`write_checkpoint`). It has the same interface as the :class:`NetCDFWriter`
+    of a backup file.
+
+    :param path: Folder of the checkpoint
+    :type path: str
+    :param background: If given, the checkpoints are written by this thread, see :class:`NetCDFWriter`, defaults to None
+    :type background: :class:`BackgroundWriter` object, optional
+    """
+    def __init__(self, path, background=None):
+        """ Constructor method
+        """
+        self.path = path
+        self.background = background
+        try:
+            self.generation = read_manifest(path)['generation'] + 1
+        except FileNotFoundError:
+            self.generation = 0
+
+    def save_history(self, history):
+        """ Writes the states of a history as a new checkpoint
+
+        :param history: History to save
+        :type history: :class:`History` object
+        """
+        if self.background is not None:
+            self.background.submit(self._write, [State.snapshot(state) for state in history.state_list])
+        else:
+            self._write(history.state_list)
+
+    @traced('write_checkpoint', 'output')
+    def _write(self, states):
+        write_checkpoint(self.path, states, self.generation)
+        self.generation += 1
+
+    def close(self):
+        """ Waits for the checkpoints written in the background
+        """
+        if self.background is not None:
+            self.background.wait()
@@ -0,0 +1,204 @@
+import importlib.util
+
+import numpy as np
+import netCDF4
+
+from ..methods.fft_backend import NumpyFFT
+
+# Distributed runs: the grid is split into slabs of rows (first axis), one per
+# MPI process. The pointwise computations are done on the slabs, the spectral
+# transforms exchange the slabs of rows for slabs of columns of the spectrum
+# (transpose FFT), and the interpolations gather the rows of the neighbouring
+# slabs they need in halos.
+# mpi4py is an optional dependency: it is only imported by the distributed
+# runs, launched with e.g. mpirun -n 4 python script.py (see Simulation), as
+# importing it initializes MPI.
+
+has_mpi = importlib.util.find_spec('mpi4py') is not None
+
+# True when netCDF4 is built with parallel input/output: the processes then write
+# their slabs collectively, otherwise the slabs are gathered by the first process.
+has_parallel_io = bool(netCDF4.__has_parallel4_support__ or netCDF4.__has_pnetcdf_support__)
+
+class SlabDecomposition():
+    """ This class encodes the decomposition of a grid into slabs of rows, one per process of an MPI communicator.
+    The fields of a process are its rows of the grid, (..., rows, Ny), and its spectra (see :class:`DistributedFFT`)
+    its columns of the half spectrum, (..., Nx, columns).
+
+    :param comm: MPI communicator of the processes
+    :type comm: mpi4py.MPI.Comm
+    :param Nx: Number of rows of the grid
+    :type Nx: int
+    :param Ny: Number of columns of the grid
+    :type Ny: int
+    :param parallel_io: If True, the output files are written collectively (netCDF4 must be built with parallel support),
+        otherwise the slabs are gathered and written by the first process, defaults to None (True if netCDF4 supports it)
+    :type parallel_io: bool, optional
+    :raises "mpi4py is needed": mpi4py is not installed
+    :raises "More processes than": a process would have no row or no column of the spectrum
+    """
+    def __init__(self, comm, Nx, Ny, parallel_io=None):
+        """ Constructor method
+        """
+        if not has_mpi:
+            raise Exception('mpi4py is needed by the distributed runs')
+        self.comm = comm
+        self.rank = comm.Get_rank()
+        self.size = comm.Get_size()
+        self.shape = (Nx, Ny)
+        if self.size > Nx or self.size > Ny//2 + 1:
+            raise Exception('More processes than rows or spectral columns of the grid ({} processes)'.format(self.size))
+        self.parallel_io = has_parallel_io if parallel_io is None else parallel_io
+
+        bounds = np.linspace(0, Nx, self.size + 1).astype(int)
+        self.row_counts = np.diff(bounds)
+        self.rows = slice(bounds[self.rank], bounds[self.rank + 1])
+        bounds = np.linspace(0, Ny//2 + 1, self.size + 1).astype(int)
+        self.column_counts = np.diff(bounds)
+        self.columns = slice(bounds[self.rank], bounds[self.rank + 1])
+
+    @property
+    def root(self):
+        """ True for the first process, which prints and creates the output files
+        """
+        return self.rank == 0
+
+    def max(self, value):
+        """ Maximum of a scalar over the processes, or elementwise maximum of an array
+
+        :param value: Value of the process
+        :type value: float or ndarray
+        :rtype: float or ndarray
+        """
+        from mpi4py import MPI
+        if np.ndim(value):
+            value = np.ascontiguousarray(value, dtype=float)
+            result = np.empty_like(value)
+            self.comm.Allreduce(value, result, op=MPI.MAX)
+            return result
+        return self.comm.allreduce(value, op=MPI.MAX)
+
+    def halo_width(self, alpha):
+        """ Number of rows of the neighbouring slabs needed to interpolate at the points x - alpha (see :class:`InterpolationPlan`):
+        the 4x4 bicubic stencils reach up to two rows beyond the largest displacement of the grid
+
+        :param alpha: Displacements of the rows of the process, in grid cells
+        :type alpha: ndarray
+        :rtype: int
+        """
+        return int(np.ceil(self.max(float(np.max(np.abs(alpha))) if alpha.size else 0.))) + 2
+
+    def halo(self, f, width):
+        """ Rows of a field extended by the width last rows of the previous slab and the width first rows of the next slab (periodic grid)
+
+        :param f: Rows of the process, the rows being the second to last axis
+        :type f: ndarray
+        :param width: Number of rows of each halo
+        :type width: int
+        :raises "wider than a slab": a halo needs the rows of more than the neighbouring slab
+        :return: Array of width more rows on both sides
+        :rtype: ndarray
+        """
+        if width > min(self.row_counts):
+            raise Exception('The halo ({} rows) is wider than a slab: use fewer processes'.format(width))
+        first = np.ascontiguousarray(f[..., :width, :])
+        last = np.ascontiguousarray(f[..., -width:, :])
+        if self.size == 1:
+            return np.concatenate([last, f, first], axis=-2)
+        previous = (self.rank - 1) % self.size
+        following = (self.rank + 1) % self.size
+        before = np.empty_like(last)
+        after = np.empty_like(first)
+        self.comm.Sendrecv(last, dest=following, recvbuf=before, source=previous)
+        self.comm.Sendrecv(first, dest=previous, recvbuf=after, source=following)
+        return np.concatenate([before, f, after], axis=-2)
+
+    def gather(self, f, axis=-2, root=0):
+        """ Assembles the slabs of the processes on one of them
+
+        :param f: Rows of the process
+        :type f: ndarray
+        :param axis: Axis of the rows, defaults to -2
+        :type axis: int, optional
+        :param root: Rank of the process receiving the grid, defaults to 0
+        :type root: int, optional
+        :return: The whole field on root, None on the other processes
+        :rtype: ndarray
+        """
+        f = np.ascontiguousarray(np.moveaxis(f, axis, 0))
+        other = f.shape[1:]
+        counts = self.row_counts * int(np.prod(other))
+        whole = np.empty((self.shape[0],) + other, dtype=f.dtype) if self.rank == root else None
+        self.comm.Gatherv(f, [whole, counts] if self.rank == root else None, root=root)
+        return np.moveaxis(whole, 0, axis) if whole is not None else None
+
+    def transpose(self, f, inverse=False):
+        """ Exchanges the slabs of rows of a (half) spectrum for slabs of columns, or the converse if inverse is True
+
+        :param f: Rows (..., rows, Ny//2 + 1) of the process, or columns (..., Nx, columns) if inverse is True
+        :type f: ndarray
+        :param inverse: Direction of the exchange, defaults to False
+        :type inverse: bool, optional
+        :rtype: ndarray
+        """
+        lead = f.shape[:-2]
+        size = int(np.prod(lead))
+        # the block sent to each process is cut along the columns (the rows if inverse):
+        # a process sends its keep[rank] rows (columns) and receives cut[rank] columns (rows)
+        cut, keep = (self.row_counts, self.column_counts) if inverse else (self.column_counts, self.row_counts)
+        bounds = np.concatenate([[0], np.cumsum(cut)])
+        if inverse:
+            blocks = [f[..., bounds[i]:bounds[i+1], :] for i in range(self.size)]
+        else:
+            blocks = [f[..., bounds[i]:bounds[i+1]] for i in range(self.size)]
+        send = np.concatenate([block.ravel() for block in blocks])
+        send_counts = cut * keep[self.rank] * size
+        recv_counts = keep * cut[self.rank] * size
+        recv = np.empty(int(np.sum(recv_counts)), dtype=f.dtype)
+        self.comm.Alltoallv([send, send_counts], [recv, recv_counts])
+        # the blocks received are put side by side along the other axis
+        offsets = np.concatenate([[0], np.cumsum(recv_counts)])
+        if inverse:
+            blocks = [recv[offsets[i]:offsets[i+1]].reshape(lead + (cut[self.rank], keep[i])) for i in range(self.size)]
+            return np.concatenate(blocks, axis=-1)
+        blocks = [recv[offsets[i]:offsets[i+1]].reshape(lead + (keep[i], cut[self.rank])) for i in range(self.size)]
+        return np.concatenate(blocks, axis=-2)
+
+class DistributedFFT(NumpyFFT):
+    """ This class encodes the FFT backend of the distributed runs (see :mod:`profitroll.methods.fft_backend`).
+    The real transforms of the rows of each process are done locally, then the spectrum is transposed
+    (:meth:`SlabDecomposition.transpose`) and transformed along the first axis: a process holds the
+    columns :attr:`SlabDecomposition.columns` of the half spectrum, the spectral operators being restricted
+    to them (see :func:`spectral.geostwind`). The local transforms use :mod:`numpy.fft`.
+
+    :param decomposition: Decomposition of the grid
+    :type decomposition: :class:`SlabDecomposition` object
+    """
+    name = 'distributed'
+
+    def __init__(self, decomposition):
+        """ Constructor method
+        """
+        self.decomposition = decomposition
+
+    def rfft2(self, x):
+        """ Real forward transform over the last two axes
+
+        :param x: Rows of a real field
+        :type x: ndarray
+        :return: Columns of the half spectrum of the field
+        :rtype: ndarray
+        """
+        return np.fft.fft(self.decomposition.transpose(np.fft.rfft(x, axis=-1)), axis=-2)
+
+    def irfft2(self, X, s):
+        """ Inverse of :meth:`rfft2`
+
+        :param X: Columns of a half spectrum
+        :type X: ndarray
+        :param s: Shape of the whole real field
+        :type s: tuple of int
+        :return: Rows of the real field
+        :rtype: ndarray
+        """
+        return np.fft.irfft(self.decomposition.transpose(np.fft.ifft(X, axis=-2), inverse=True), n=s[-1], axis=-1)
@@ -1,4 +1,9 @@
-from .state import State
+from copy import deepcopy
+
+import numpy as np
+
+from .state import State, Variables, forced_variables
+from .checkpoint import read_checkpoint
 
 class History():
 	""" This class encodes the list of :class:`State` objects useful at each simulation step (evolving through simulation)
@@ -17,18 +22,54 @@ class History():
 		self.size = len(state_list)
 		
 	@classmethod
-	def fromCDF(cls, netCDF_file):
+	def fromCDF(cls, netCDF_file, dtype=None, variables=None, lazy=False, rows=None):
 		""" Other constructor method which construct a :class:`History` object from a netCDF file
 
 		:param netCDF_file: NetCDF file used to create the :class:`History` object
 		:type netCDF_file: Dataset at NETCDF4 format
+		:param dtype: Floating point type of the variables, defaults to None (type of the file)
+		:type dtype: numpy dtype, optional
+		:param variables: list of the variables to load, defaults to None (all the variables of the file)
+		:type variables: list of str, optional
+		:param lazy: If True, each variable of each state is read when it is accessed for the first time (see :class:`LazyVariable`), defaults to False
+		:type lazy: bool, optional
+		:param rows: Rows of the grid to read, e.g. the slab of a process of a distributed run (not available with lazy), defaults to None (whole grid)
+		:type rows: slice, optional
 		"""
 		size = netCDF_file.dimensions['Nt'].size
-		if size > 0:
-			state_list = [State.fromCDF(netCDF_file, k) for k in range(size)]
-			return cls(state_list)
-		else:
-			raise 'Empty CDF while initialising History'
+		if size == 0:
+			raise Exception('Empty CDF while initialising History')
+		if lazy:
+			if rows is not None:
+				raise Exception('The rows of a lazy History cannot be selected')
+			return cls([State.fromCDF(netCDF_file, k, dtype, variables, lazy=True) for k in range(size)])
+
+		# each variable is read in one call and split into states in memory
+		times = netCDF_file['t'][:].data
+		variables = [var for var in netCDF_file.variables if var not in forced_variables
+					 and (variables is None or var in variables)]
+		rows = rows if rows is not None else slice(None)
+		stacks = {var: np.ascontiguousarray(np.moveaxis(netCDF_file[var][...,rows,:,:].data, -1, 0)) for var in variables}
+		state_list = []
+		for k in range(size):
+			state = State(float(times[k]), dtype=dtype)
+			state.vrs.update({var: stack[k] for var, stack in stacks.items()})
+			state_list.append(state)
+		return cls(state_list)
+
+	@classmethod
+	def fromcheckpoint(cls, path, dtype=None, variables=None):
+		""" Other constructor method which construct a :class:`History` object from a checkpoint folder (see :mod:`profitroll.core.checkpoint`).
+		The variables are memory-mapped, thus they are not copied.
+
+		:param path: Folder of the checkpoint
+		:type path: str
+		:param dtype: Floating point type of the variables, defaults to None (type of the files)
+		:type dtype: numpy dtype, optional
+		:param variables: list of the variables to load, defaults to None (all the variables of the checkpoint)
+		:type variables: list of str, optional
+		"""
+		return cls(read_checkpoint(path, dtype, variables=variables))
 
 	def save(self, netCDF_file, backup=False, saved_variables=None):
 		""" Saves the first state of state_list in a netCDF file (or the entire state_list if backup is True)
@@ -45,9 +86,24 @@ class History():
         # thus it is this one we choose to export
 			self.state_list[0].save(netCDF_file, backup=False, saved_vrs=saved_variables)
 		else:
-			for ind, state in enumerate(self.state_list):
-				state.save(netCDF_file, backup=True, k=ind)
+			# one write per variable for the whole history
+			states = self.state_list
+			n = len(states)
+			netCDF_file['t'][:n] = [state.t for state in states]
+			for var in netCDF_file.variables:
+				if var not in forced_variables:
+					netCDF_file[var][...,:n] = np.stack([state.vrs[var] for state in states], axis=-1)
 				
+	def new_state(self, state):
+		""" Returns a copy of a state, meant to be modified and then added with :meth:`append`
+
+		:param state: State to copy
+		:type state: :class:`State` object
+		:return: The copy (see :meth:`State.copy`)
+		:rtype: :class:`State` object
+		"""
+		return State.copy(state)
+
 	def append(self, state):
 		""" Adds a :class:`State` object at the end of the state_list
 
@@ -68,3 +124,223 @@ class History():
 			self.size -= 1
 		except Exception as error:
 			raise error
+
+
+class SlotVariables(Variables):
+	""" This class encodes the variables of a :class:`State` stored in a slot of a :class:`RingHistory`.
+	Each buffered variable is stored in a row of the (depth, Nx, Ny) array of the ring, owned by this
+	object: assigning such a variable copies the values into the row instead of keeping the given array.
+
+	An object filled from an other object of the same ring (see :meth:`fill`) reads the rows of the other
+	one (read-only views) instead of copying them. When a row read by other objects is written, one of them
+	takes the row over and gives its own row in exchange: the values of a variable are only copied when it
+	is assigned, or modified in place through :meth:`writable`.
+
+	:param buffers: Dictionary of the (depth, Nx, Ny) arrays of the ring, for each variable
+	:type buffers: dictionary
+	:param slot: Index of the slot in the buffers (the row initially owned for every variable)
+	:type slot: int
+	:param dtype: see :class:`Variables`, defaults to None
+	:type dtype: numpy dtype, optional
+	"""
+	def __init__(self, buffers, slot, dtype=None):
+		""" Constructor method
+		"""
+		super().__init__(dtype=dtype)
+		self.buffers = buffers
+		self.slot = slot
+		# row owned for each variable, and variables whose value is a row (own or read)
+		self.rows = dict.fromkeys(buffers, slot)
+		self.stored = set()
+		# owner of each row read, and objects reading each own row (by id, as dictionaries are not hashable)
+		self.lenders = {}
+		self.borrowers = {var: {} for var in buffers}
+
+	def _row(self, var, writeable=True):
+		view = self.buffers[var][self.rows[var]]
+		if not writeable:
+			view = view.view()
+			view.flags.writeable = False
+		return view
+
+	def _forget(self, var):
+		# the value of the variable is not the row of an other object anymore
+		lender = self.lenders.pop(var, None)
+		if lender is not None:
+			lender.borrowers[var].pop(id(self), None)
+		self.stored.discard(var)
+
+	def _hand_over(self, var, keep=False):
+		# The own row of a variable is about to be written: an object reading it takes
+		# it over (the other readers now read it from this object) and gives its own
+		# row in exchange, into which the values are copied if keep is True.
+		readers = self.borrowers[var]
+		if not readers:
+			return
+		heir = readers.popitem()[1]
+		heir.lenders.pop(var)
+		# the row given in exchange may still be read by other objects
+		heir._hand_over(var)
+		self.rows[var], heir.rows[var] = heir.rows[var], self.rows[var]
+		if keep:
+			np.copyto(self._row(var), heir._row(var))
+		heir.borrowers[var] = readers
+		for reader in readers.values():
+			reader.lenders[var] = heir
+		dict.__setitem__(heir, var, heir._row(var, writeable=not readers))
+		self.borrowers[var] = {}
+
+	def __setitem__(self, var, value):
+		buffer = self.buffers.get(var)
+		if buffer is not None and isinstance(value, np.ndarray) and value.shape == buffer.shape[1:]:
+			self.derived.pop(var, None)
+			self._forget(var)
+			self._hand_over(var)
+			view = self._row(var)
+			np.copyto(view, value, casting='same_kind')
+			dict.__setitem__(self, var, view)
+			self.stored.add(var)
+		else:
+			self._forget(var)
+			super().__setitem__(var, value)
+
+	def __delitem__(self, var):
+		self._forget(var)
+		super().__delitem__(var)
+
+	def pop(self, var, *args):
+		self._forget(var)
+		return super().pop(var, *args)
+
+	def clear(self):
+		for var in list(self.stored):
+			self._forget(var)
+		super().clear()
+
+	def fill(self, other):
+		""" Replaces the variables by a copy of those of an other object (derived quantities included).
+		The rows of an other object of the same ring are read, not copied.
+
+		:param other: Variables to copy
+		:type other: :class:`Variables` object
+		"""
+		self.clear()
+		ring = isinstance(other, SlotVariables) and other.buffers is self.buffers
+		for var in other:
+			if ring and var in other.stored:
+				lender = other.lenders.get(var, other)
+				if lender is not self:
+					self.lenders[var] = lender
+					lender.borrowers[var][id(self)] = self
+					# the row cannot be modified in place anymore by its owner
+					if var in lender.stored and var not in lender.lenders:
+						dict.__setitem__(lender, var, lender._row(var, writeable=False))
+				dict.__setitem__(self, var, lender._row(var, writeable=lender is self and not self.borrowers[var]))
+				self.stored.add(var)
+			else:
+				value = other[var]
+				self[var] = value if var in self.buffers else deepcopy(value)
+		self.derived = {var: dict(derived) for var, derived in other.derived.items() if var in self}
+
+	def writable(self, var):
+		if var not in self.stored:
+			return super().writable(var)
+		lender = self.lenders.get(var)
+		if lender is not None:
+			self[var] = lender._row(var)
+		else:
+			self.derived.pop(var, None)
+			self._hand_over(var, keep=True)
+			dict.__setitem__(self, var, self._row(var))
+		return dict.__getitem__(self, var)
+
+	def share(self):
+		# the slots are recycled, thus the copy cannot share their memory
+		other = Variables({var: np.array(value) if isinstance(value, np.ndarray) else deepcopy(value)
+						   for var, value in self.items()}, dtype=self.dtype)
+		other.derived = {var: dict(derived) for var, derived in self.derived.items()}
+		return other
+
+class RingHistory(History):
+	""" This class encodes a :class:`History` of fixed depth, stored in a ring buffer. Each variable
+	is kept in a single preallocated (depth, Nx, Ny) array and each :class:`State` of the history is
+	a view on rows of these arrays (see :class:`SlotVariables`). The state of the next free slot reads
+	the rows of the state it copies until its variables are written, and removing the oldest state only
+	moves the start of the ring: no array is allocated while the simulation runs, and a variable is
+	only copied when it is written.
+
+	The states handed out by the history are recycled once removed: they must not be kept
+	after a call to :meth:`pop` (use :meth:`State.copy` to keep a state).
+
+	:param state_list: List of :class:`State` objects, all with the same variables
+	:type state_list: List of :class:`State` objects
+	:param depth: Maximum number of states, defaults to None (length of state_list plus one, as one state is appended before the oldest is removed)
+	:type depth: int, optional
+	"""
+	def __init__(self, state_list, depth=None):
+		""" Constructor method
+		"""
+		depth = depth if depth is not None else len(state_list) + 1
+		if depth < len(state_list):
+			raise Exception('The depth of the RingHistory is smaller than the number of states')
+		first = state_list[0].vrs
+		self.depth = depth
+		self.buffers = {var: np.empty((depth,) + value.shape, dtype=value.dtype)
+						for var, value in first.items() if isinstance(value, np.ndarray) and value.ndim > 0}
+		self._states = []
+		for slot in range(depth):
+			state = State(None)
+			state.vrs = SlotVariables(self.buffers, slot, dtype=first.dtype)
+			self._states.append(state)
+		self.head = 0
+		self.size = 0
+		for state in state_list:
+			self.append(state)
+
+	@property
+	def state_list(self):
+		""" List of the states, from the oldest to the newest
+		"""
+		return [self._states[(self.head + i) % self.depth] for i in range(self.size)]
+
+	def _next_slot(self):
+		if self.size == self.depth:
+			raise Exception('RingHistory is full (depth {})'.format(self.depth))
+		return self._states[(self.head + self.size) % self.depth]
+
+	def new_state(self, state):
+		""" Copies a state into the next free slot, without adding it to the history yet. The arrays of a state
+		of the ring are read by the copy until they are written (see :meth:`SlotVariables.fill`)
+
+		:param state: State to copy
+		:type state: :class:`State` object
+		:return: The state of the next slot, to be given to :meth:`append`
+		:rtype: :class:`State` object
+		"""
+		slot_state = self._next_slot()
+		slot_state.t = state.t
+		slot_state.vrs.fill(state.vrs)
+		return slot_state
+
+	def append(self, state):
+		""" Adds a :class:`State` object at the end of the history. It is copied into the next slot, unless it was returned by :meth:`new_state`
+
+		:param state: This state will be added at the end of the history
+		:type state: :class:`State` object
+		"""
+		if state is not self._next_slot():
+			self.new_state(state)
+		self.size += 1
+
+	def pop(self, k=None):
+		""" Removes the oldest :class:`State` object of the history
+
+		:param k: Must be None or 0, defaults to None
+		:type k: int, optional
+		"""
+		if k not in (None, 0):
+			raise Exception('Only the oldest state of a RingHistory can be removed')
+		if self.size == 0:
+			raise Exception('Empty RingHistory')
+		self.head = (self.head + 1) % self.depth
+		self.size -= 1
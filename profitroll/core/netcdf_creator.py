@@ -2,15 +2,16 @@ import numpy as np
 from netCDF4 import Dataset
 from copy import deepcopy
 
-from .state import forced_variables
+from .state import forced_variables, set_written_frames
 #------------------------------------------------------------------------------
 
-def create_results_netcdf(path, initialCDF, params, grid, T, Nt, methods, methods_kwargs, save_rate, backup_rate, **kwargs):
+def create_results_netcdf(path, initialCDF, params, grid, T, Nt, methods, methods_kwargs, save_rate, backup_rate, precision='float64', storage=None, result_frames=None, loaded_variables=None, **kwargs):
     """ Creates a netCDF file where simulation informations will be saved
 
     :param path: Path where the netCDF file will be created
     :type path: str
-    :param initialCDF: File from which the variables of the problem will be copied 
+    :param initialCDF: File from which the variables of the problem will be copied. If it has an ensemble dimension Ne, \
+        the fields are created with the dimensions (Ne, Nx, Ny, Nt)
     :type initialCDF: Dataset at NETCDF4 format
     :param params: Dictionary containing informations about the simulation that will be saved in the new netCDF file
     :type params: dictionary
@@ -28,13 +29,32 @@ def create_results_netcdf(path, initialCDF, params, grid, T, Nt, methods, method
     :type save_rate: list of int
     :param backup_rate: list of the backup rates of the simulations that have been launched
     :type backup_rate: list of int
+    :param precision: 'float64' or 'float32', floating point type of the stored fields, defaults to 'float64'
+    :type precision: str, optional
+    :param storage: Storage options of the fields given to :meth:`Dataset.createVariable` (zlib, complevel, shuffle, least_significant_digit, chunksizes, ...),
+        as a dictionary {variable name: options}. The options of the key 'default' apply to the variables which are not listed. The fields are stored
+        in chunks of one state (Nx, Ny, 1), or of one state of one member (1, Nx, Ny, 1) for an ensemble, unless chunksizes is given, so that a state is read in one piece. Defaults to None (no compression)
+    :type storage: dictionary, optional
+    :param result_frames: If given, the Nt dimension is created with this fixed length instead of being unlimited, and the number of written
+        states is kept in the nb_frames attribute (see :func:`written_frames`), defaults to None
+    :type result_frames: int, optional
+    :param loaded_variables: list of the variables of initialCDF to create, defaults to None (all of them)
+    :type loaded_variables: list of str, optional
     """ 
 
     handle = Dataset(path, 'w', format='NETCDF4', parallel=False)
 
     handle.createDimension("Nx", grid.Nx)
     handle.createDimension("Ny", grid.Ny)
-    handle.createDimension("Nt", None) 
+    handle.createDimension("Nt", result_frames)
+    # ensemble of simulations: the fields have a leading member axis
+    ensemble = "Ne" in initialCDF.dimensions
+    if ensemble:
+        handle.createDimension("Ne", initialCDF.dimensions["Ne"].size)
+    field_dims = ("Ne", "Nx", "Ny", "Nt") if ensemble else ("Nx", "Ny", "Nt")
+    frame_chunks = ((1,) if ensemble else ()) + (grid.Nx, grid.Ny, 1)
+    if result_frames is not None:
+        handle.nb_frames = 0 
 
     handle.T = deepcopy(T)
     list(map(lambda item: handle.setncattr(*item), params.items())) 
@@ -52,10 +72,14 @@ def create_results_netcdf(path, initialCDF, params, grid, T, Nt, methods, method
     handle.save_rate = deepcopy(save_rate)
     handle.backup_rate = deepcopy(backup_rate) 
 
-    # "f8" is a data type: 64-bit floating point variable
+    # "f8" is a data type: 64-bit floating point variable ("f4": 32-bit)
+    field_type = np.dtype(precision).str[1:]
+    storage = storage if storage is not None else {}
     for var in initialCDF.variables:
-        if (var not in forced_variables):
-            handle.createVariable(var, "f8", ("Nx", "Ny", "Nt"))
+        if (var not in forced_variables) and (loaded_variables is None or var in loaded_variables):
+            options = dict(storage.get(var, storage.get('default', {})))
+            options.setdefault('chunksizes', frame_chunks)
+            handle.createVariable(var, field_type, field_dims, **options)
 
     handle.createVariable("t", "f8", ("Nt"))
     handle.createVariable("x_grid", "f8", ("Nx", "Ny"))
@@ -66,7 +90,7 @@ def create_results_netcdf(path, initialCDF, params, grid, T, Nt, methods, method
     
     handle.close()
 
-def results_netcdf_frombackup(path, backupCDF, pre_resultCDF, **kwargs):
+def results_netcdf_frombackup(path, backupCDF, pre_resultCDF, history=None, **kwargs):
     """ Completes a netCDF file with the previous results (until the last backup)
 
     :param path: Path of the new netCDF result file
@@ -75,19 +99,21 @@ def results_netcdf_frombackup(path, backupCDF, pre_resultCDF, **kwargs):
     :type backupCDF: Dataset at NETCDF4 format
     :param pre_resultCDF: File from which the previous values of the variables will be copied 
     :type pre_resultCDF: Dataset at NETCDF4 format
+    :param history: History the simulation restarts from (read from backupCDF or from a checkpoint), defaults to None (first time of backupCDF)
+    :type history: :class:`History` object, optional
     """
     
     handle = Dataset(path, 'r+', format='NETCDF4', parallel=False)
 
-    t_tocopy = np.where(pre_resultCDF['t'][:].data < backupCDF['t'][0])
+    t_backup = history.state_list[0].t if history is not None else backupCDF['t'][0]
+    t_tocopy = np.where(pre_resultCDF['t'][:].data < t_backup)
     kmax = np.argmax(t_tocopy) if t_tocopy else 0
     
     for var in handle.variables:
         if (var not in forced_variables):
-            for k in range(kmax):
-                handle[var][:,:,k] = pre_resultCDF[var][:,:,k]
+            handle[var][...,:kmax] = pre_resultCDF[var][...,:kmax]
 
-    for k in range(kmax):
-        handle['t'][k] = pre_resultCDF['t'][k]
+    handle['t'][:kmax] = pre_resultCDF['t'][:kmax]
+    set_written_frames(handle, kmax)
 
     handle.close()
\ No newline at end of file
@@ -5,12 +5,33 @@ import time
 from datetime import datetime
 from copy import deepcopy
 
-from .history import History
+from .history import History, RingHistory
 from .grid import Grid
+from .writer import NetCDFWriter, BackgroundWriter
+from .checkpoint import CheckpointWriter, read_manifest
 from .netcdf_creator import create_results_netcdf, results_netcdf_frombackup
+from .tracing import activate, span
+from .distributed import SlabDecomposition, DistributedFFT
+from ..methods.fft_backend import get_backend
 
 forced_attributes = ['T','Nt','methods','methods_kwargs','save_rate','backup_rate']
 
+def methods_variables(methods):
+    """ Variables needed by a list of methods, which declare the variables they read or write in their variables attribute
+
+    :param methods: list of the methods
+    :type methods: list of functions
+    :raises "does not declare its variables": A method has no variables attribute
+    :return: The variables, without duplicates
+    :rtype: list of str
+    """
+    variables = []
+    for method in methods:
+        if not hasattr(method, 'variables'):
+            raise Exception('The method ' + method.__name__ + ' does not declare its variables')
+        variables += [var for var in method.variables if var not in variables]
+    return variables
+
 class Simulation():
     """ This class encodes the simulation
 
@@ -41,9 +62,56 @@ class Simulation():
     :type saved_variables: list of str, optional
     :param verbose: Amount of informations that will be printed when running the simulation, defaults to 0
     :type verbose: int, optional
+    :param fft_backend: FFT backend given to the spectral methods: 'numpy', 'scipy', 'pyfftw' or a backend object (see :mod:`profitroll.methods.fft_backend`), defaults to None (numpy)
+    :type fft_backend: str or backend object, optional
+    :param fft_workers: Number of threads used by the 'scipy' and 'pyfftw' backends, defaults to None (all the available cores)
+    :type fft_workers: int, optional
+    :param precision: 'float64' or 'float32', floating point type of the state fields, of the computations and of the result and backup files, defaults to 'float64'.
+        In 'float32', the fields carry about 7 significant digits. On the v-stripe test case (256x128 grid, 300 s time step), the maximum
+        difference with a 'float64' run, relative to the maximum of the field, stays below 2e-5 for every field after a day of simulation.
+        This is well below the errors of the semi-Lagrangian scheme, but results are not bit-comparable with 'float64' runs.
+    :type precision: str, optional
+    :param ring_history: If True, the history is a :class:`RingHistory` (preallocated arrays, no allocation while running), defaults to False
+    :type ring_history: bool, optional
+    :param flush_rate: Number of saved states kept in memory before being written to the result file (see :class:`NetCDFWriter`), defaults to 10.
+        The result file is also flushed before each backup refresh so that it is never behind the backup file.
+    :type flush_rate: int, optional
+    :param storage: Storage options of the fields of the result file (compression, quantization, chunks), see :func:`create_results_netcdf`, defaults to None.
+        The backup file is never quantized nor compressed, so that a simulation restarts exactly.
+    :type storage: dictionary, optional
+    :param result_frames: Preallocated number of states of the result file, when the length of the runs is known (see :func:`create_results_netcdf`), defaults to None (unlimited)
+    :type result_frames: int, optional
+    :param backup_format: 'netcdf' or 'checkpoint'. With 'checkpoint', the backups are written in the folder checkpoint_<name> of output_folder
+        (memory-mappable arrays, see :mod:`profitroll.core.checkpoint`) instead of the backup netCDF file, which only keeps the attributes of the runs.
+        Such a backup is restarted with :meth:`frombackup` and its checkpoint argument. Defaults to 'netcdf'
+    :type backup_format: str, optional
+    :param load_variables: Variables of initialCDF loaded in the history and written in the result and backup files: 'all', 'methods'
+        (the variables declared by the methods, see :func:`methods_variables`) or a list of names, defaults to 'all'
+    :type load_variables: str or list of str, optional
+    :param params: Parameters replacing the attributes of initialCDF (N_s, gamma_2, Delta_zc, ...), e.g. for parameter sweeps (see :mod:`profitroll.core.sweep`), defaults to None
+    :type params: dictionary, optional
+    :param lazy_loading: If True, the variables of the initial history are read from initialCDF when they are used for the first time
+        (see :class:`LazyVariable`) instead of when the simulation is created, defaults to False
+    :type lazy_loading: bool, optional
+    :param tracer: If given, records the time spent in each run, time step, method call, save, backup and write (see :class:`Tracer`), defaults to None
+    :type tracer: :class:`Tracer` object, optional
+    :param async_output: If True, the result and backup files are written by a background thread (see :class:`BackgroundWriter`) while the next steps are computed, defaults to False
+    :type async_output: bool, optional
+    :param output_queue_size: Maximum number of writes waiting for the background thread before the time loop waits, defaults to 4
+    :type output_queue_size: int, optional
+    :param comm: MPI communicator of a distributed run (e.g. mpi4py.MPI.COMM_WORLD, the script being launched with mpirun -n 4 python script.py).
+        The grid is split into slabs of rows, one per process (see :mod:`profitroll.core.distributed`): each process reads and computes its rows,
+        the spectral methods use a distributed transpose FFT (fft_backend is then ignored) and the interpolations exchange halos as wide as
+        the largest displacement. The output files are created by the first process and written collectively if netCDF4 is built with parallel
+        support, otherwise through the first process. Every process must open initialCDF. Not available with async_output, lazy_loading and
+        the checkpoint backups; the 'diffusive' interpolation cannot be used. Defaults to None
+    :type comm: mpi4py.MPI.Comm, optional
     """
     
-    def __init__(self, initialCDF, methods, methods_kwargs, output_folder, save_rate=[], backup_rate=[], T=[], Nt=[], verbose=0, saved_variables=None, name=None, frombackup=False, pre_resultCDF=None):
+    def __init__(self, initialCDF, methods, methods_kwargs, output_folder, save_rate=[], backup_rate=[], T=[], Nt=[], verbose=0, saved_variables=None, name=None, frombackup=False, pre_resultCDF=None,
+                 fft_backend=None, fft_workers=None, precision='float64', ring_history=False, flush_rate=10,
+                 async_output=False, output_queue_size=4, storage=None, result_frames=None,
+                 backup_format='netcdf', checkpoint=None, load_variables='all', lazy_loading=False, params=None, tracer=None, comm=None):
         """ Constructor method
         
         :param initialCDF: netCDF file from which the parameters of the simulation, the initial history and the grid will be copied
@@ -52,16 +120,43 @@ class Simulation():
         :type frombackup: bool, optional
         :param pre_resultCDF: Previous result file if the simulation is created from a backup file (frombackup must be True), defaults to None
         :type pre_resultCDF: Dataset at NETCDF4 format, optional
+        :param checkpoint: Checkpoint folder from which the initial history is read instead of initialCDF (frombackup must be True), defaults to None
+        :type checkpoint: str, optional
         """
         if ((not frombackup) and (pre_resultCDF is not None)):
             initialCDF.close()
             pre_resultCDF.close()
             raise Exception('frombackup is False and 2 netCDF files were given ')
+        if backup_format not in ('netcdf', 'checkpoint'):
+            initialCDF.close()
+            raise Exception('Unknown backup format: ' + backup_format)
+        if comm is not None and (async_output or lazy_loading or backup_format == 'checkpoint' or checkpoint is not None):
+            initialCDF.close()
+            raise Exception('async_output, lazy_loading and the checkpoint backups are not available in distributed runs')
 
         # store the initial data
-        self.history = History.fromCDF(initialCDF)
+        self.precision = np.dtype(precision).name
+        self.storage = storage
+        self.result_frames = result_frames
+        if isinstance(load_variables, str):
+            if load_variables not in ('all', 'methods'):
+                initialCDF.close()
+                raise Exception('Unknown load_variables option: ' + load_variables)
+            self.loaded_variables = methods_variables(methods) if load_variables == 'methods' else None
+        else:
+            self.loaded_variables = list(load_variables)
         self.params = {at: initialCDF.__dict__[at] for at in initialCDF.__dict__ if at not in forced_attributes}
+        self.params.update(params if params is not None else {})
         self.grid = Grid(**self.params)
+
+        # in a distributed run, each process only holds its rows of the grid
+        self.decomposition = SlabDecomposition(comm, self.grid.Nx, self.grid.Ny) if comm is not None else None
+        history_class = RingHistory if ring_history else History
+        if checkpoint is not None:
+            self.history = history_class.fromcheckpoint(checkpoint, dtype=self.precision, variables=self.loaded_variables)
+        else:
+            rows = self.decomposition.rows if self.decomposition is not None else None
+            self.history = history_class.fromCDF(initialCDF, dtype=self.precision, variables=self.loaded_variables, lazy=lazy_loading, rows=rows)
         
         self.T = T
         self.Nt = Nt
@@ -86,10 +181,13 @@ class Simulation():
         result_path = output_folder + '/results_'+self.name+'.nc'
         backup_path = output_folder + '/backup_'+self.name+'.nc'
 
-        create_results_netcdf(result_path, initialCDF, **self.__dict__)
-        if (frombackup and (pre_resultCDF is not None)):
-            results_netcdf_frombackup(result_path, initialCDF, pre_resultCDF, **self.__dict__)
-        create_results_netcdf(backup_path, initialCDF, **self.__dict__)
+        if self.decomposition is None or self.decomposition.root:
+            create_results_netcdf(result_path, initialCDF, **self.__dict__)
+            if (frombackup and (pre_resultCDF is not None)):
+                results_netcdf_frombackup(result_path, initialCDF, pre_resultCDF, **self.__dict__)
+            create_results_netcdf(backup_path, initialCDF, **dict(self.__dict__, storage=None, result_frames=None))
+        if self.decomposition is not None:
+            self.decomposition.comm.Barrier()
 
 
         initialCDF.close()
@@ -98,9 +196,18 @@ class Simulation():
 
         # other parameters
         self.verbose = verbose
+        self.flush_rate = flush_rate
+        self.backup_format = backup_format
+        self.async_output = async_output
+        self.output_queue_size = output_queue_size
+        self.tracer = tracer
+        if self.decomposition is not None:
+            self.fft_backend = DistributedFFT(self.decomposition)
+        else:
+            self.fft_backend = get_backend(fft_backend, **({'workers': fft_workers} if fft_workers is not None else {}))
 
     @classmethod
-    def frombackup(cls, backupCDF, methods, methods_kwargs, output_folder, resultCDF=None, name=None, saved_variables=None, verbose=1):
+    def frombackup(cls, backupCDF, methods, methods_kwargs, output_folder, resultCDF=None, name=None, saved_variables=None, verbose=1, checkpoint=None, **kwargs):
         """ Other constructor method which construct a :class:`Simulation` object from a backup netCDF file. Informations to end the last simulation
         launched will be printed.
 
@@ -120,25 +227,31 @@ class Simulation():
 	    :type saved_variables: list of str, optional
         :param verbose: Amount of informations that will be printed when running the simulation, defaults to 1
 	    :type verbose: int, optional
+        :param checkpoint: Checkpoint folder of the backups, if the simulation was run with backup_format='checkpoint' (backupCDF then only gives the attributes of the runs), defaults to None
+        :type checkpoint: str, optional
+        :param kwargs: Other arguments given to the constructor (fft_backend, ...)
         """
         date = datetime.now()
         name = name if name is not None else 'frombackup_' + date.strftime("%Y_%m_%d_%H:%M:%S")
         
-        T = deepcopy(backupCDF.T)
-        Nt = deepcopy(backupCDF.Nt)
+        # netCDF4 reads the attributes of length 1 as scalars
+        T = np.atleast_1d(deepcopy(backupCDF.T))
+        Nt = np.atleast_1d(deepcopy(backupCDF.Nt))
 
-        save_rate = deepcopy(backupCDF.save_rate)
-        backup_rate = deepcopy(backupCDF.backup_rate)
+        save_rate = np.atleast_1d(deepcopy(backupCDF.save_rate))
+        backup_rate = np.atleast_1d(deepcopy(backupCDF.backup_rate))
 
-        missing_T = sum(T)-(backupCDF['t'][0]-resultCDF['t'][0]) if resultCDF is not None else sum(T)-backupCDF['t'][0]
+        backup_t = np.array(read_manifest(checkpoint)['t']) if checkpoint is not None else backupCDF['t'][:].data
+
+        missing_T = sum(T)-(backup_t[0]-resultCDF['t'][0]) if resultCDF is not None else sum(T)-backup_t[0]
         able = 2
         if (resultCDF is None) :
-            able = 1 if len(backupCDF['t'][:].data) > 1 else 0
-            dt = backupCDF['t'][1].data - backupCDF['t'][0].data if len(backupCDF['t'][:].data) > 1 else 1
-            nb_v_step = backupCDF['t'][0].data / dt
+            able = 1 if len(backup_t) > 1 else 0
+            dt = backup_t[1] - backup_t[0] if len(backup_t) > 1 else 1
+            nb_v_step = backup_t[0] / dt
             missing_Nt = sum(Nt)-nb_v_step
         else :
-            valid_save = (np.where(resultCDF['t'][:].data < backupCDF['t'][0].data))[0] 
+            valid_save = (np.where(resultCDF['t'][:].data < backup_t[0]))[0] 
             nb_v_save = len(valid_save) 
             save_sim_comp = np.sum(np.array(Nt[:-1])//save_rate[:-1])
             missing_Nt = int(Nt[-1] - (nb_v_save - save_sim_comp)*save_rate[-1])
@@ -161,7 +274,7 @@ class Simulation():
 
         return cls(backupCDF, methods, methods_kwargs, output_folder, save_rate, backup_rate, T=T, Nt=Nt,
                     verbose=verbose, saved_variables=saved_variables, 
-                    name=name, frombackup=True, pre_resultCDF=resultCDF)
+                    name=name, frombackup=True, pre_resultCDF=resultCDF, checkpoint=checkpoint, **kwargs)
 
 
     def run(self, T, Nt, save_rate, backup_rate, first_run=True):
@@ -177,6 +290,8 @@ class Simulation():
         :type backup_rate: int
         :param first_run: True if it is the first run of this simulation (for save purpose), defaults to True 
         :type first_run: bool, optional
+        :return: Total CPU time of each method
+        :rtype: ndarray
         """
         if (backup_rate%save_rate):
             raise Exception('For recovery from backup purpose save_rate must divide backup_rate')
@@ -184,46 +299,75 @@ class Simulation():
         cpu_tot_time = np.zeros(len(self.methods))
         simu_time = time.time()
 
-        # Saving parameters of the new run
-        backupCDF = Dataset(self.output_folder + '/backup_'+self.name+'.nc', 'r+', format='NETCDF4', parallel=False)
-        resultsCDF = Dataset(self.output_folder + '/results_'+self.name+'.nc', 'r+', format='NETCDF4', parallel=False)
-        for ob in [self, backupCDF, resultsCDF]:
-            ob.T = np.append(ob.T, T)
-            ob.Nt = np.append(ob.Nt, Nt)
-            ob.save_rate = np.append(ob.save_rate, save_rate)
-            ob.backup_rate = np.append(ob.backup_rate, backup_rate)
-        backupCDF.close()
-        resultsCDF.close()  
-
-        if self.verbose:
-            print("          ------------------------")
-            print("          |  RUNNING SIMULATION  |")
-            print("          ------------------------")
-        for iter_nb in range(Nt):
-            print("\n\nIteration ", iter_nb, "...") if self.verbose else None
-            # first handle saving
-            if (iter_nb % self.backup_rate[-1] == 0) and not (iter_nb==0 and not first_run):
-                backupCDF = Dataset(self.output_folder + '/backup_'+self.name+'.nc', 'r+', format='NETCDF4', parallel=False)
-                self.history.save(backupCDF, backup=True)
-                backupCDF.close()
-                print("---> backup refreshed at iteration "+str(iter_nb)) if self.verbose else None
-            if iter_nb % self.save_rate[-1] == 0 and not (iter_nb==0 and not first_run):
-                resultsCDF = Dataset(self.output_folder + '/results_'+self.name+'.nc', 'r+', format='NETCDF4', parallel=False)
-                self.history.save(resultsCDF, backup=False, saved_variables=self.saved_variables)  
-                resultsCDF.close()  
-                print("---> saved results of iteration "+str(iter_nb)) if self.verbose else None
-
-            # then perform forward
-            cpu_time = self.forward()
-            cpu_tot_time += cpu_time    
-        
-        # Last save/backup
-        backupCDF = Dataset(self.output_folder + '/backup_'+self.name+'.nc', 'r+', format='NETCDF4', parallel=False)
-        self.history.save(backupCDF, backup=True)
-        backupCDF.close()
-        resultsCDF = Dataset(self.output_folder + '/results_'+self.name+'.nc', 'r+', format='NETCDF4', parallel=False)
-        self.history.save(resultsCDF, backup=False, saved_variables=self.saved_variables)  
-        resultsCDF.close() 
+        # the spans of the run are recorded by the tracer of the simulation, if any (see tracing.py)
+        with activate(self.tracer), span('run', 'simulation', T=T, Nt=Nt):
+            # the output files are kept open during the whole run
+            background = BackgroundWriter(self.output_queue_size) if self.async_output else None
+            backupCDF = NetCDFWriter(self.output_folder + '/backup_'+self.name+'.nc', background=background, decomposition=self.decomposition)
+            resultsCDF = NetCDFWriter(self.output_folder + '/results_'+self.name+'.nc', self.saved_variables, self.flush_rate, background,
+                                      self.decomposition)
+            if self.backup_format == 'checkpoint':
+                backup = CheckpointWriter(self.output_folder + '/checkpoint_'+self.name, background)
+            else:
+                backup = backupCDF
+            try:
+                # Saving parameters of the new run
+                for ob in [self] + [writer.dataset for writer in (backupCDF, resultsCDF) if writer.dataset is not None]:
+                    ob.T = np.append(ob.T, T)
+                    ob.Nt = np.append(ob.Nt, Nt)
+                    ob.save_rate = np.append(ob.save_rate, save_rate)
+                    ob.backup_rate = np.append(ob.backup_rate, backup_rate)
+
+                if self.verbose:
+                    print("          ------------------------")
+                    print("          |  RUNNING SIMULATION  |")
+                    print("          ------------------------")
+                for iter_nb in range(Nt):
+                    print("\n\nIteration ", iter_nb, "...") if self.verbose else None
+                    # first handle saving
+                    if (iter_nb % self.backup_rate[-1] == 0) and not (iter_nb==0 and not first_run):
+                        with span('backup', 'simulation', iteration=iter_nb):
+                            resultsCDF.flush()
+                            backup.save_history(self.history)
+                        print("---> backup refreshed at iteration "+str(iter_nb)) if self.verbose else None
+                    if iter_nb % self.save_rate[-1] == 0 and not (iter_nb==0 and not first_run):
+                        with span('save', 'simulation', iteration=iter_nb):
+                            resultsCDF.save(self.history.state_list[0])
+                        print("---> saved results of iteration "+str(iter_nb)) if self.verbose else None
+
+                    # then perform forward
+                    with span('step', 'simulation', iteration=iter_nb):
+                        cpu_time = self.forward()
+                    cpu_tot_time += cpu_time    
+            
+                # Last save/backup
+                with span('backup', 'simulation', iteration=Nt):
+                    resultsCDF.flush()
+                    backup.save_history(self.history)
+                with span('save', 'simulation', iteration=Nt):
+                    resultsCDF.save(self.history.state_list[0])
+            finally:
+                try:
+                    # each output is closed even if closing another one fails (a failed
+                    # write of the results must not lose the backup), then the first error is raised
+                    errors = []
+                    for writer in (resultsCDF, backup, backupCDF):
+                        try:
+                            writer.close()
+                        except Exception as error:
+                            errors.append(error)
+                    if errors:
+                        raise errors[0]
+                finally:
+                    if background is not None:
+                        background.close()
+                    # the files are complete when run returns, on every process
+                    if self.decomposition is not None:
+                        self.decomposition.comm.Barrier()
+
+        # keep the FFT plans knowledge for the next runs
+        if hasattr(self.fft_backend, 'save_wisdom'):
+            self.fft_backend.save_wisdom()
 
         # FINAL PRINT : Print Total and Mean CPU time per method
         for ind, method in enumerate(self.methods):
@@ -231,9 +375,11 @@ class Simulation():
             print("Mean CPU time for method ", method.__name__, " per call = {:.2f}".format(cpu_tot_time[ind]/self.Nt[-1]), " seconds") if self.verbose else None
 
         simu_time = time.time() - simu_time
-        print("\n**************************************************\n")
-        print("TOTAL METHODS TIME = {:.2f}".format(np.sum(cpu_tot_time)), " seconds")
-        print("TOTAL SIMULATION TIME = {:.2f}".format(simu_time), " seconds")
+        if self.decomposition is None or self.decomposition.root:
+            print("\n**************************************************\n")
+            print("TOTAL METHODS TIME = {:.2f}".format(np.sum(cpu_tot_time)), " seconds")
+            print("TOTAL SIMULATION TIME = {:.2f}".format(simu_time), " seconds")
+        return cpu_tot_time
 
     def forward(self):
         """ One step of simulation : apply each method to the history.
@@ -242,7 +388,8 @@ class Simulation():
         for ind, (method, kwargs) in enumerate(zip(self.methods, self.methods_kwargs)):
             t0 = time.time()
             print("      *** Proceeding to method: "+method.__name__) if self.verbose > 1 else None
-            method(**self.__dict__, **kwargs)
+            with span(method.__name__, 'method'):
+                method(**self.__dict__, **kwargs)
             cpu_time[ind] = time.time() - t0 
             print("      *** CPU time = {:.2f}".format(cpu_time[ind]), " seconds") if self.verbose > 1 else None
         return cpu_time
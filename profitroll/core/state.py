@@ -1,8 +1,195 @@
 import numpy as np
 from copy import deepcopy
+from netCDF4 import Dataset
         
 forced_variables = ['x_grid','y_grid','t'] # General variables     
 
+class LazyVariable():
+    """ This class encodes a variable of a netCDF file which is read only when it is accessed
+    (see :class:`Variables`). The file is opened again at this time, thus it can be closed meanwhile.
+
+    :param path: Path of the netCDF file
+    :type path: str
+    :param var: Name of the variable
+    :type var: str
+    :param k: Time rank of the state in the file, defaults to None (whole variable)
+    :type k: int, optional
+    """
+    def __init__(self, path, var, k=None):
+        """ Constructor method
+        """
+        self.path = path
+        self.var = var
+        self.k = k
+
+    def load(self):
+        """ Reads the variable
+
+        :rtype: ndarray
+        """
+        with Dataset(self.path, 'r', format='NETCDF4', parallel=False) as handle:
+            return handle[self.var][...,self.k].data if self.k is not None else handle[self.var][:].data
+
+def written_frames(netCDF_file):
+    """ Number of states written in a result file. It is the size of the Nt dimension, unless
+    this dimension has been preallocated (see :func:`create_results_netcdf`): the count is then
+    kept in the nb_frames attribute of the file.
+
+    :param netCDF_file: Result file
+    :type netCDF_file: Dataset at NETCDF4 format
+    :rtype: int
+    """
+    if 'nb_frames' in netCDF_file.ncattrs():
+        return int(netCDF_file.nb_frames)
+    return netCDF_file.dimensions['Nt'].size
+
+def set_written_frames(netCDF_file, n):
+    """ Updates the number of states written in a result file with a preallocated Nt dimension (nothing is done otherwise)
+
+    :param netCDF_file: Result file
+    :type netCDF_file: Dataset at NETCDF4 format
+    :param n: Number of written states
+    :type n: int
+    """
+    if 'nb_frames' in netCDF_file.ncattrs():
+        netCDF_file.nb_frames = max(int(netCDF_file.nb_frames), n)
+
+class Variables(dict):
+    """ This class encodes the dictionary of the variables of a :class:`State` object. It also stores
+    quantities derived from the variables (spectra, ...) which are discarded when the variable
+    is written. 
+    
+    Note that modifying an array in place (``vrs[var][i,j] = ...``) is not detected: the variable
+    must be assigned again, or :meth:`invalidate` must be called.
+
+    A variable can also be a :class:`LazyVariable`: it is then read from its file the first time
+    it is accessed through ``vrs[var]``, :meth:`get`, :meth:`items` or :meth:`values`.
+
+    The arrays can be shared with other :class:`Variables` objects (see :meth:`share`). Shared arrays
+    are read-only: a variable is duplicated only when it is written through :meth:`writable`, and
+    assigning a new array to a variable simply stops sharing it.
+
+    :param dtype: If given, the floating point arrays assigned to the variables are converted to this type, defaults to None
+    :type dtype: numpy dtype, optional
+    """
+    def __init__(self, *args, dtype=None, **kwargs):
+        """Constructor method
+        """
+        super().__init__()
+        self.derived = {}
+        self.shared = set()
+        self.dtype = np.dtype(dtype) if dtype is not None else None
+        self.update(*args, **kwargs)
+
+    def __getitem__(self, var):
+        value = super().__getitem__(var)
+        if isinstance(value, LazyVariable):
+            self[var] = value.load()
+            value = super().__getitem__(var)
+        return value
+
+    def get(self, var, default=None):
+        return self[var] if var in self else default
+
+    def items(self):
+        return [(var, self[var]) for var in self]
+
+    def values(self):
+        return [self[var] for var in self]
+
+    def __setitem__(self, var, value):
+        self.derived.pop(var, None)
+        if (self.dtype is not None and isinstance(value, np.ndarray)
+                and np.issubdtype(value.dtype, np.floating) and value.dtype != self.dtype):
+            value = value.astype(self.dtype)
+        self.shared.discard(var)
+        super().__setitem__(var, value)
+
+    def __delitem__(self, var):
+        self.derived.pop(var, None)
+        self.shared.discard(var)
+        super().__delitem__(var)
+
+    def pop(self, var, *args):
+        self.derived.pop(var, None)
+        self.shared.discard(var)
+        return super().pop(var, *args)
+
+    def update(self, *args, **kwargs):
+        for var, value in dict(*args, **kwargs).items():
+            self[var] = value
+
+    def clear(self):
+        self.derived.clear()
+        self.shared.clear()
+        super().clear()
+
+    def share(self):
+        """ Returns a copy which shares the arrays (and their derived quantities) of this object.
+        The shared arrays are replaced by read-only views in both objects, so that none of them
+        can be modified in place without calling :meth:`writable` first.
+
+        :return: The copy
+        :rtype: :class:`Variables` object
+        """
+        other = Variables(dtype=self.dtype)
+        # the variables which are not loaded yet stay lazy in both objects
+        for var, value in dict.items(self):
+            if isinstance(value, np.ndarray):
+                if var not in self.shared:
+                    value = value.view()
+                    value.flags.writeable = False
+                    super().__setitem__(var, value)
+                    self.shared.add(var)
+                other.shared.add(var)
+            else:
+                value = deepcopy(value)
+            dict.__setitem__(other, var, value)
+        other.derived = {var: dict(derived) for var, derived in self.derived.items()}
+        return other
+
+    def writable(self, var):
+        """ Returns the array of a variable so that it can be modified in place. The array is
+        duplicated first if it is shared with another object, and the derived quantities of the
+        variable are discarded.
+
+        :param var: Name of the variable
+        :type var: str
+        :return: Array of the variable, owned by this object
+        :rtype: ndarray
+        """
+        if var in self.shared:
+            super().__setitem__(var, np.array(self[var]))
+            self.shared.discard(var)
+        self.derived.pop(var, None)
+        return self[var]
+
+    def invalidate(self, var=None):
+        """ Discards the quantities derived from a variable
+
+        :param var: Name of the variable, defaults to None (all the variables)
+        :type var: str, optional
+        """
+        if var is None:
+            self.derived.clear()
+        else:
+            self.derived.pop(var, None)
+
+    def memoized(self, var, key, func):
+        """ Returns func(self[var]), computed only if the variable has been written since the last call with the same key.
+
+        :param var: Name of the variable
+        :type var: str
+        :param key: Identifier of the derived quantity
+        :type key: hashable
+        :param func: Function computing the derived quantity from the variable
+        :type func: function
+        """
+        derived = self.derived.setdefault(var, {})
+        if key not in derived:
+            derived[key] = func(self[var])
+        return derived[key]
+
 class State():
     """ This class encodes an object which contains all the variables at a given time t.
 
@@ -10,38 +197,76 @@ class State():
 	:type t: float
 	:param vrs: Dictionary of the variables and their values
 	:type vrs: dictionary
+	:param dtype: Floating point type of the variables (see :class:`Variables`), defaults to None (types are kept)
+	:type dtype: numpy dtype, optional
 	"""
-    def __init__(self, t, vrs={}):
+    def __init__(self, t, vrs={}, dtype=None):
         """Constructor method
         """
         self.t = t
-        self.vrs = deepcopy(vrs)
+        self.vrs = Variables(deepcopy(dict(vrs)), dtype=dtype)
 
     @classmethod
-    def fromCDF(cls, netCDF_file, k=None):
+    def fromCDF(cls, netCDF_file, k=None, dtype=None, variables=None, lazy=False):
         """ Other constructor method which construct a :class:`State` object from a netCDF file
 
         :param netCDF_file: NetCDF file used to create the :class:`State` object
 		:type netCDF_file: Dataset at NETCDF4 format
         :param k: time rank of the state to create in the NetCDF file, defaults to None
         :type k: int, optional
+        :param dtype: Floating point type of the variables, defaults to None (type of the file)
+        :type dtype: numpy dtype, optional
+        :param variables: list of the variables to load, defaults to None (all the variables of the file)
+        :type variables: list of str, optional
+        :param lazy: If True, the variables are read when they are accessed for the first time (see :class:`LazyVariable`), defaults to False
+        :type lazy: bool, optional
         """
-        t = np.float(netCDF_file['t'][k].data) if k is not None else None
+        t = float(netCDF_file['t'][k].data) if k is not None else None
 
-        variables = [var for var in netCDF_file.variables if var not in forced_variables]
-        vrs = {var: netCDF_file[var][:,:,k].data if k is not None else netCDF_file[var][:].data
+        variables = [var for var in netCDF_file.variables if var not in forced_variables
+                     and (variables is None or var in variables)]
+        if lazy:
+            state = cls(t, dtype=dtype)
+            state.vrs.update({var: LazyVariable(netCDF_file.filepath(), var, k) for var in variables})
+            return state
+        vrs = {var: netCDF_file[var][...,k].data if k is not None else netCDF_file[var][:].data
                for var in variables}
 
-        return cls(t, vrs)
+        return cls(t, vrs, dtype)
 
     @classmethod
     def copy(cls, otherState):
-        """Creates a copy of an other :class:`State` object
+        """Creates a copy of an other :class:`State` object. The copy is made on write: the arrays
+        of the variables are shared by the two states (see :meth:`Variables.share`) until one of
+        them assigns a new array to a variable or asks for a writable one with :meth:`writable`.
 
         :param otherState: :class:`State` object to copy
 		:type otherState: :class:`State` object
         """
-        return cls(otherState.t, otherState.vrs)
+        state = cls(otherState.t, dtype=otherState.vrs.dtype)
+        state.vrs = otherState.vrs.share()
+        return state
+
+    @classmethod
+    def snapshot(cls, otherState):
+        """Creates a copy of an other :class:`State` object to be handed to another thread (see :class:`BackgroundWriter`).
+        As :meth:`copy`, but the lazy variables are read first, in the calling thread: the netCDF library
+        is not thread safe and the files are then only accessed by the thread which writes them.
+
+        :param otherState: :class:`State` object to copy
+		:type otherState: :class:`State` object
+        """
+        otherState.vrs.values()
+        return cls.copy(otherState)
+
+    def writable(self, var):
+        """Array of a variable which can be modified in place, see :meth:`Variables.writable`
+
+        :param var: Name of the variable
+        :type var: str
+        :rtype: ndarray
+        """
+        return self.vrs.writable(var)
 
     def save(self, netCDF_file, saved_vrs=None, backup=False, k=None):
         """Save the state into a given NetCDF file.
@@ -56,7 +281,7 @@ class State():
         :type k: int, optional
         """
         # current location to fill
-        k = netCDF_file.dimensions['Nt'].size if not backup else k
+        k = written_frames(netCDF_file) if not backup else k
 
         # filling the variables
         netCDF_file['t'][k] = self.t
@@ -64,4 +289,6 @@ class State():
         variables = [var for var in netCDF_file.variables if var not in forced_variables]
         export_variables = saved_vrs if saved_vrs is not None else variables
         for var in export_variables:
-            netCDF_file[var][:,:,k] = self.vrs[var]
+            netCDF_file[var][...,k] = self.vrs[var]
+        if not backup:
+            set_written_frames(netCDF_file, k+1)
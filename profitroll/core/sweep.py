@@ -0,0 +1,124 @@
+import contextlib
+import csv
+import os
+import time
+import traceback
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from multiprocessing import shared_memory
+
+import numpy as np
+from netCDF4 import Dataset
+
+from .simulation import Simulation
+
+# A sweep runs several simulations in a pool of processes. Each initial netCDF
+# file is read once into a shared memory block, which the workers open as an
+# in-memory (read-only) Dataset: the initial condition is neither copied for
+# each run nor read again from the disk.
+
+summary_fields = ['name', 'initial', 'status', 'wall_time', 'methods_time', 'error']
+run_arguments = ['T', 'Nt', 'save_rate', 'backup_rate']
+
+def _share_file(path):
+    size = os.path.getsize(path)
+    block = shared_memory.SharedMemory(create=True, size=max(size, 1))
+    with open(path, 'rb') as handle:
+        handle.readinto(block.buf[:size])
+    return block, size
+
+def _run_config(config, block_name, size, output_folder):
+    """ Runs one configuration of a sweep in a worker process, its prints going to the file log_<name>.txt of output_folder
+    """
+    t0 = time.time()
+    row = {'name': config['name'], 'initial': config['initial'], 'status': 'done', 'methods_time': np.nan, 'error': ''}
+    kwargs = {key: value for key, value in config.items()
+              if key not in ['initial', 'methods', 'methods_kwargs'] + run_arguments}
+    block = shared_memory.SharedMemory(name=block_name)
+    try:
+        with open(os.path.join(output_folder, 'log_' + config['name'] + '.txt'), 'w') as log, \
+             contextlib.redirect_stdout(log):
+            try:
+                # the path is kept as the name of the dataset, for the lazy loading of the variables
+                initialCDF = Dataset(config['initial'], memory=block.buf[:size])
+                simulation = Simulation(initialCDF, config['methods'], config['methods_kwargs'], output_folder, **kwargs)
+                cpu_time = simulation.run(*[config[arg] for arg in run_arguments])
+                row['methods_time'] = float(np.sum(cpu_time))
+            except Exception as error:
+                traceback.print_exc(file=log)
+                row['status'] = 'failed'
+                row['error'] = repr(error)
+            finally:
+                # release the views on the shared memory before closing it
+                initialCDF = simulation = None
+    finally:
+        block.close()
+    row['wall_time'] = time.time() - t0
+    return row
+
+def run_sweep(configs, output_folder, processes=None, verbose=1):
+    """ Runs simulations differing by their parameters, initial file or methods in a pool of processes.
+
+    Each configuration is a dictionary with the keys:
+
+    - 'initial': path of the initial netCDF file. Each file is loaded once in shared memory, whatever the number of runs using it
+    - 'methods', 'methods_kwargs': the methods of the simulation and their arguments (methods must be defined at the top level of a module)
+    - 'T', 'Nt', 'save_rate', 'backup_rate': the arguments of :meth:`Simulation.run`
+    - 'name': name of the run, which must be unique. Defaults to run_<index of the configuration>
+    - any other argument of :class:`Simulation`, e.g. 'params' to replace parameters of the initial file ({'N_s': 1e-2}) or 'fft_workers'
+
+    Each run writes its own result and backup files in output_folder (see :class:`Simulation`) and its prints
+    in log_<name>.txt. A run raising an exception is reported as failed in the summary, the other runs go on.
+
+    :param configs: Configurations of the runs
+    :type configs: list of dictionaries
+    :param output_folder: Path to the folder where the files of the runs and the summary sweep_summary.csv are saved
+    :type output_folder: str
+    :param processes: Number of processes running simulations at the same time, defaults to None (number of cores)
+    :type processes: int, optional
+    :param verbose: If not 0, the summary is printed and the end of each run is announced, defaults to 1
+    :type verbose: int, optional
+    :raises "names of the runs must be unique": Two configurations have the same name
+    :return: The summary, one row per configuration in the order of configs, with the keys of summary_fields
+        (wall_time and methods_time in seconds, status 'done' or 'failed')
+    :rtype: list of dictionaries
+    """
+    configs = [dict(config, name=config.get('name', 'run_{}'.format(ind))) for ind, config in enumerate(configs)]
+    names = [config['name'] for config in configs]
+    if len(set(names)) < len(names):
+        raise Exception('The names of the runs must be unique')
+    os.makedirs(output_folder, exist_ok=True)
+
+    blocks = {}
+    rows = [None] * len(configs)
+    try:
+        for config in configs:
+            if config['initial'] not in blocks:
+                blocks[config['initial']] = _share_file(config['initial'])
+        with ProcessPoolExecutor(max_workers=processes) as pool:
+            futures = {pool.submit(_run_config, config, blocks[config['initial']][0].name,
+                                   blocks[config['initial']][1], output_folder): ind
+                       for ind, config in enumerate(configs)}
+            for future in as_completed(futures):
+                ind = futures[future]
+                try:
+                    rows[ind] = future.result()
+                except Exception as error:
+                    # the worker process itself failed (killed, unpicklable configuration, ...)
+                    rows[ind] = {'name': names[ind], 'initial': configs[ind]['initial'], 'status': 'failed',
+                                 'wall_time': np.nan, 'methods_time': np.nan, 'error': repr(error)}
+                print('run {} {}'.format(names[ind], rows[ind]['status'])) if verbose else None
+    finally:
+        for block, size in blocks.values():
+            block.close()
+            block.unlink()
+
+    with open(os.path.join(output_folder, 'sweep_summary.csv'), 'w', newline='') as handle:
+        writer = csv.DictWriter(handle, fieldnames=summary_fields)
+        writer.writeheader()
+        writer.writerows(rows)
+
+    if verbose:
+        print('\n{:<24} {:<8} {:>12} {:>14}'.format('name', 'status', 'wall time', 'methods time'))
+        for row in rows:
+            print('{:<24} {:<8} {:>12.2f} {:>14.2f}'.format(row['name'], row['status'], row['wall_time'], row['methods_time']))
+    return rows
@@ -0,0 +1,155 @@
+import contextlib
+import csv
+import functools
+import json
+import os
+import threading
+import time
+
+# Tracing is disabled as long as no tracer is active: span() then returns a
+# shared empty context and the functions decorated by traced() are called
+# directly, so that the instrumentation left in the code costs a test per call.
+
+_tracer = None
+_null_span = contextlib.nullcontext()
+
+span_fields = ['name', 'category', 'thread', 'depth', 'start', 'duration', 'args']
+
+class Tracer():
+    """ This class encodes a recorder of the time spent in the parts of a simulation (spans).
+    The :class:`Simulation` records a span for each run, time step, method call, save and backup,
+    the output files a span for each write (in the thread performing it), and the spectral
+    transforms and interpolations nested spans.
+
+    Each span is a dictionary with the keys of span_fields: start and duration are in seconds
+    (start from the creation of the tracer), depth is the number of spans of the same thread containing it.
+
+    :param hooks: Functions called at the beginning and at the end of each span as hook(event, span), event being 'begin' or 'end'
+        (the duration of the span is known at the end only), defaults to None
+    :type hooks: list of functions, optional
+    """
+    def __init__(self, hooks=None):
+        """ Constructor method
+        """
+        self.hooks = list(hooks) if hooks is not None else []
+        self.spans = []
+        self._origin = time.perf_counter()
+        self._local = threading.local()
+
+    @contextlib.contextmanager
+    def span(self, name, category='profitroll', **args):
+        """ Context manager recording the time spent in its block
+
+        :param name: Name of the span
+        :type name: str
+        :param category: Category of the span ('simulation', 'method', 'output', 'spectral', 'interpolation', ...), defaults to 'profitroll'
+        :type category: str, optional
+        :param args: Details stored with the span
+        """
+        depth = getattr(self._local, 'depth', 0)
+        record = {'name': name, 'category': category, 'thread': threading.current_thread().name,
+                  'depth': depth, 'start': time.perf_counter() - self._origin, 'duration': None, 'args': args}
+        for hook in self.hooks:
+            hook('begin', record)
+        self._local.depth = depth + 1
+        try:
+            yield record
+        finally:
+            self._local.depth = depth
+            record['duration'] = time.perf_counter() - self._origin - record['start']
+            self.spans.append(record)
+            for hook in self.hooks:
+                hook('end', record)
+
+    def totals(self):
+        """ Number of calls and total time of each span name
+
+        :return: {name: (number of spans, total duration in seconds)}, from the longest to the shortest total
+        :rtype: dictionary
+        """
+        totals = {}
+        for record in self.spans:
+            count, duration = totals.get(record['name'], (0, 0.))
+            totals[record['name']] = (count + 1, duration + record['duration'])
+        return dict(sorted(totals.items(), key=lambda item: -item[1][1]))
+
+    def write_chrome_trace(self, path):
+        """ Writes the spans in the trace event format of Chrome (chrome://tracing, Perfetto)
+
+        :param path: Path of the JSON file
+        :type path: str
+        """
+        pid = os.getpid()
+        threads = {}
+        events = []
+        for record in self.spans:
+            tid = threads.setdefault(record['thread'], len(threads))
+            events.append({'name': record['name'], 'cat': record['category'], 'ph': 'X', 'pid': pid, 'tid': tid,
+                           'ts': record['start'] * 1e6, 'dur': record['duration'] * 1e6,
+                           'args': {key: str(value) for key, value in record['args'].items()}})
+        events += [{'name': 'thread_name', 'ph': 'M', 'pid': pid, 'tid': tid, 'args': {'name': thread}}
+                   for thread, tid in threads.items()]
+        with open(path, 'w') as handle:
+            json.dump({'traceEvents': events, 'displayTimeUnit': 'ms'}, handle)
+
+    def write_csv(self, path):
+        """ Writes the spans in a CSV file, one line per span (the args are written in JSON)
+
+        :param path: Path of the CSV file
+        :type path: str
+        """
+        with open(path, 'w', newline='') as handle:
+            writer = csv.DictWriter(handle, fieldnames=span_fields)
+            writer.writeheader()
+            for record in self.spans:
+                writer.writerow(dict(record, args=json.dumps(record['args'], default=str)))
+
+def active_tracer():
+    """ Tracer recording the spans, None if tracing is disabled
+
+    :rtype: :class:`Tracer` object
+    """
+    return _tracer
+
+@contextlib.contextmanager
+def activate(tracer):
+    """ Context manager making a tracer active in its block (in every thread)
+
+    :param tracer: Tracer to activate. If None, the active tracer is left unchanged
+    :type tracer: :class:`Tracer` object
+    """
+    global _tracer
+    previous = _tracer
+    if tracer is not None:
+        _tracer = tracer
+    try:
+        yield tracer
+    finally:
+        _tracer = previous
+
+def span(name, category='profitroll', **args):
+    """ Span of the active tracer (see :meth:`Tracer.span`), or an empty context manager if tracing is disabled
+    """
+    if _tracer is None:
+        return _null_span
+    return _tracer.span(name, category, **args)
+
+def traced(name=None, category='profitroll'):
+    """ Decorator recording a span for each call of a function when a tracer is active
+
+    :param name: Name of the spans, defaults to None (name of the function)
+    :type name: str, optional
+    :param category: Category of the spans, defaults to 'profitroll'
+    :type category: str, optional
+    """
+    def decorator(func):
+        span_name = name if name is not None else func.__name__
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if _tracer is None:
+                return func(*args, **kwargs)
+            with _tracer.span(span_name, category):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
@@ -0,0 +1,222 @@
+import queue
+import threading
+
+import numpy as np
+from netCDF4 import Dataset
+
+from .state import State, forced_variables, written_frames, set_written_frames
+from .history import History
+from .tracing import span, traced
+
+class BackgroundWriter():
+    """ This class encodes a thread performing the writes of :class:`NetCDFWriter` objects in the
+    background, in the order they were submitted. At most max_queue writes are waiting: when the
+    queue is full, the caller waits for a write to be done (backpressure).
+
+    An exception raised by a write is raised again in the caller thread at the next call of
+    :meth:`submit`, :meth:`wait` or :meth:`close`; the writes submitted afterwards are skipped.
+
+    :param max_queue: Maximum number of pending writes, defaults to 4
+    :type max_queue: int, optional
+    """
+    def __init__(self, max_queue=4):
+        """ Constructor method
+        """
+        self._queue = queue.Queue(maxsize=max(int(max_queue), 1))
+        self._error = None
+        self._thread = threading.Thread(target=self._work, name='profitroll-writer', daemon=True)
+        self._thread.start()
+
+    def _work(self):
+        while True:
+            task = self._queue.get()
+            try:
+                if task is None:
+                    return
+                if self._error is None:
+                    func, args = task
+                    func(*args)
+            except BaseException as error:
+                self._error = error
+            finally:
+                self._queue.task_done()
+
+    def _check(self):
+        if self._error is not None:
+            raise self._error
+
+    def submit(self, func, *args):
+        """ Adds func(*args) to the queue of writes
+
+        :param func: Write to perform
+        :type func: function
+        """
+        self._check()
+        self._queue.put((func, args))
+
+    def wait(self):
+        """ Waits until all the submitted writes are done
+        """
+        self._queue.join()
+        self._check()
+
+    def close(self):
+        """ Waits for the submitted writes and stops the thread
+        """
+        if self._thread.is_alive():
+            self._queue.put(None)
+            self._thread.join()
+        self._check()
+
+class NetCDFWriter():
+    """ This class encodes an output netCDF file (result or backup file) kept open during a run.
+    The states given to :meth:`save` are kept in memory and written together, as one hyperslab
+    per variable, every flush_rate states or when :meth:`flush` or :meth:`close` is called.
+
+    It can be used as a context manager, the file being flushed and closed on exit.
+
+    :param path: Path of the netCDF file, created beforehand by :func:`create_results_netcdf`
+    :type path: str
+    :param saved_variables: list of the variables written by :meth:`save`, defaults to None (all the variables of the file)
+    :type saved_variables: list of str, optional
+    :param flush_rate: Number of states kept in memory before being written, defaults to 1
+    :type flush_rate: int, optional
+    :param background: If given, the writes are performed by this thread. The caller only takes a snapshot of the
+        states (:meth:`State.snapshot`, which shares the arrays until they are written) and goes on, defaults to None
+    :type background: :class:`BackgroundWriter` object, optional
+    :param decomposition: Decomposition of the grid of a distributed run: the states hold the rows of the process. Every process
+        must call the methods of the writer. The file is opened by every process and the slabs written collectively
+        if the decomposition has parallel_io, otherwise it is opened by the first process only, which gathers the slabs
+        (dataset is then None on the other processes), defaults to None
+    :type decomposition: :class:`SlabDecomposition` object, optional
+    """
+    def __init__(self, path, saved_variables=None, flush_rate=1, background=None, decomposition=None):
+        """ Constructor method
+        """
+        self.path = path
+        self.decomposition = decomposition
+        self.collective = decomposition is not None and decomposition.parallel_io
+        if self.collective:
+            from mpi4py import MPI
+            self.dataset = Dataset(path, 'r+', format='NETCDF4', parallel=True, comm=decomposition.comm, info=MPI.Info())
+            for var in self.dataset.variables.values():
+                var.set_collective(True)
+        elif decomposition is None or decomposition.root:
+            self.dataset = Dataset(path, 'r+', format='NETCDF4', parallel=False)
+        else:
+            self.dataset = None
+        if self.dataset is not None:
+            self.variables = [var for var in self.dataset.variables if var not in forced_variables]
+        if decomposition is not None and not self.collective:
+            self.variables = decomposition.comm.bcast(self.variables if decomposition.root else None, root=0)
+        self.saved_variables = saved_variables if saved_variables is not None else self.variables
+        self.flush_rate = max(int(flush_rate), 1)
+        self.background = background
+        self._t = []
+        self._buffer = {var: [] for var in self.saved_variables}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def save(self, state):
+        """ Adds a state at the end of the file. The arrays are copied, thus the state can be modified afterwards.
+
+        :param state: State to save
+        :type state: :class:`State` object
+        """
+        if self.background is not None:
+            self.background.submit(self._save, State.snapshot(state))
+        else:
+            self._save(state)
+
+    def _save(self, state):
+        self._t.append(state.t)
+        for var in self.saved_variables:
+            self._buffer[var].append(np.array(state.vrs[var]))
+        if len(self._t) >= self.flush_rate:
+            self._flush()
+
+    def flush(self):
+        """ Writes the states kept in memory
+        """
+        if self.background is not None:
+            self.background.submit(self._flush)
+        else:
+            self._flush()
+
+    def _write(self, var, frames, values):
+        # Writes the fields (..., Nx, Ny, n) of a variable at the given time ranks
+        # (the rows of the process in a distributed run)
+        if self.decomposition is None:
+            self.dataset[var][...,frames] = values
+        elif self.collective:
+            self.dataset[var][...,self.decomposition.rows,:,frames] = values
+        else:
+            values = self.decomposition.gather(values, axis=-3)
+            if values is not None:
+                self.dataset[var][...,frames] = values
+
+    def _flush(self):
+        n = len(self._t)
+        if n == 0:
+            return
+        with span('write_states', 'output', path=self.path, states=n):
+            # without collective writes, only the first process has the file
+            k = written_frames(self.dataset) if self.dataset is not None else 0
+            if self.dataset is not None:
+                dim = self.dataset.dimensions['Nt']
+                if not dim.isunlimited() and k+n > dim.size:
+                    raise Exception('The result file is full ({} preallocated states)'.format(dim.size))
+                self.dataset['t'][k:k+n] = self._t
+            for var in self.saved_variables:
+                self._write(var, slice(k, k+n), np.stack(self._buffer[var], axis=-1))
+                self._buffer[var] = []
+            self._t = []
+            if self.dataset is not None:
+                set_written_frames(self.dataset, k+n)
+                self.dataset.sync()
+
+    def save_history(self, history):
+        """ Replaces the first time ranks of the file by the states of a history (backup), as :meth:`History.save` does with backup=True.
+        It is written immediately.
+
+        :param history: History to save
+        :type history: :class:`History` object
+        """
+        if self.background is not None:
+            self.background.submit(self._save_history, History([State.snapshot(state) for state in history.state_list]))
+        else:
+            self._save_history(history)
+
+    @traced('write_backup', 'output')
+    def _save_history(self, history):
+        if self.decomposition is None:
+            history.save(self.dataset, backup=True)
+        else:
+            # as History.save, the slabs being written by _write
+            states = history.state_list
+            n = len(states)
+            if self.dataset is not None:
+                self.dataset['t'][:n] = [state.t for state in states]
+            for var in self.variables:
+                self._write(var, slice(0, n), np.stack([state.vrs[var] for state in states], axis=-1))
+        if self.dataset is not None:
+            self.dataset.sync()
+
+    def close(self):
+        """ Waits for the background writes, writes the states kept in memory and closes the file
+        """
+        try:
+            if self.background is not None:
+                self.background.wait()
+        finally:
+            if self.dataset is None:
+                self._flush()
+            elif self.dataset.isopen():
+                try:
+                    self._flush()
+                finally:
+                    self.dataset.close()
@@ -8,7 +8,9 @@ from IPython.display import HTML
 from base64 import b64encode
 import os
 
-def make_video(pathCDF, save_path, variable, cmap='magma'):
+from ..core.state import written_frames
+
+def make_video(pathCDF, save_path, variable, cmap='magma', member=0):
     """Loads the data stored in a NetCDF file, builds a video of the asked variable and saves it. It returns an HTML animation that can be displayed in a Jupyter notebook.
     
     :param pathCDF: path of the NetCDF file where to read the data
@@ -17,6 +19,8 @@ def make_video(pathCDF, save_path, variable, cmap='magma'):
     :type save_path: string
     :param variable: physical quantity to plot on video, must belong to the NetCDF file
     :type variable: string
+    :param member: member plotted if the file holds an ensemble of simulations, defaults to 0
+    :type member: int, optional
     :return: an HTML animation containing the video asked
     :rtype: IPython.core.display.HTML
     """
@@ -26,10 +30,14 @@ def make_video(pathCDF, save_path, variable, cmap='magma'):
         pass
     
     resultsCDF = Dataset(pathCDF, 'r', format='NETCDF4', parallel=False)
+    nb_frames = written_frames(resultsCDF)
+    values = resultsCDF[variable]
+    if 'Ne' in values.dimensions:
+        values = values[member]
 
     # Get min and max value for the colorbar
-    min_value = np.min(resultsCDF[variable][:].data)
-    max_value = np.max(resultsCDF[variable][:].data)
+    min_value = np.min(values[:,:,:nb_frames].data)
+    max_value = np.max(values[:,:,:nb_frames].data)
 
     ## Figure Options ##
     
@@ -50,10 +58,10 @@ def make_video(pathCDF, save_path, variable, cmap='magma'):
     
     frames = []
     
-    for iteration_nb in range(resultsCDF.dimensions['Nt'].size):
+    for iteration_nb in range(nb_frames):
     
         # Creating the figure
-        myFig = plt.imshow(resultsCDF[variable][:,:,iteration_nb].T, 
+        myFig = plt.imshow(values[:,:,iteration_nb].T, 
                           origin='lower', 
                           cmap=cmap,
                           vmin=min_value,
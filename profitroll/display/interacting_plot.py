@@ -4,10 +4,11 @@ from matplotlib.colors import Normalize
 import numpy as np
 from netCDF4 import Dataset
 from .animate import var2str
+from ..core.state import written_frames
 
 import ipywidgets as widgets
 
-def plot_data(pathCDF, variable, time, cmap='magma'):
+def plot_data(pathCDF, variable, time, cmap='magma', member=0):
     """ Plot a variable from a NetCDF file using matlplotlib.
 
     :param pathCDF: path of the NetDCF file
@@ -18,14 +19,20 @@ def plot_data(pathCDF, variable, time, cmap='magma'):
     :type time: int
     :param cmap: colormap to use, defaults to 'magma'
     :type cmap: str, optional
+    :param member: member plotted if the file holds an ensemble of simulations, defaults to 0
+    :type member: int, optional
     """
     resultsCDF = Dataset(pathCDF, 'r', format='NETCDF4', parallel=False)
+    nb_frames = written_frames(resultsCDF)
     
     # Get min and max value for the colorbar
-    min_value = np.min(resultsCDF[variable][:])
-    max_value = np.max(resultsCDF[variable][:])
+    values = resultsCDF[variable][...,:nb_frames] if 'Nt' in resultsCDF[variable].dimensions else resultsCDF[variable][:]
+    if 'Ne' in resultsCDF[variable].dimensions:
+        values = values[member]
+    min_value = np.min(values)
+    max_value = np.max(values)
 
-    if(len(np.shape(resultsCDF[variable])) == 3):
+    if(len(np.shape(values)) == 3):
     	# Figure Options
         fig = plt.figure(figsize=(12,8))
         ax = plt.subplot(111)
@@ -47,7 +54,7 @@ def plot_data(pathCDF, variable, time, cmap='magma'):
         subtitle = 'Elapsed Time = {}'.format(int(np.floor(htime//3600))) + 'h {}min'.format(int(np.floor(htime%3600//60)))
         ax.text(0.1, -0.15, subtitle, size=plt.rcParams["axes.titlesize"], ha="center", transform=ax.transAxes)
         # Figure
-        plt.imshow(resultsCDF[variable][:,:,time].T,
+        plt.imshow(values[:,:,time].T,
                     origin='lower', 
                     cmap=cmap,
                     vmin=min_value,
@@ -68,7 +75,7 @@ def interactive_plot(pathCDF):
     """
     resultsCDF = Dataset(pathCDF, 'r', format='NETCDF4', parallel=False)
 
-    times = resultsCDF['t'][:].data
+    times = resultsCDF['t'][:written_frames(resultsCDF)].data
     times_ind = np.arange(len(times))
 
     disp_times = [ '{}'.format(int(np.floor(times[k]//3600))) + 'h {}min'.format(int(np.floor(times[k]%3600//60))) for k in times_ind]
@@ -76,6 +83,7 @@ def interactive_plot(pathCDF):
     vars_opts = list(resultsCDF.variables)
     cmap_opts = ['magma','Greys','hot','viridis','plasma','inferno','cividis']
     time_opts = [(disp_times[k], k) for k in times_ind]
+    nb_members = resultsCDF.dimensions['Ne'].size if 'Ne' in resultsCDF.dimensions else 1
     
     resultsCDF.close()
 
@@ -95,9 +103,14 @@ def interactive_plot(pathCDF):
                                 description='colormap :',
                                 disabled=False)
     
+    member_widg = widgets.IntSlider(value=0, min=0, max=nb_members-1,
+                                    description='member :',
+                                    continuous_update=False) if nb_members > 1 else widgets.fixed(0)
+
     inter = widgets.interactive(plot_data, 
                                 pathCDF=widgets.fixed(pathCDF),
                                 cmap=cmap_widg,
                                 variable=vars_widg,
-                                time=time_widg)
+                                time=time_widg,
+                                member=member_widg)
     return inter
@@ -1,27 +1,205 @@
 import numpy as np
 
-from .upstream_interp import upstream_interp
+from .upstream_interp import InterpolationPlan
+from .workspace import get_workspace
+from . import jit_kernels
+
+def wind_differences(u, v, workspace=None):
+    """ Centered differences of the wind along the grid indices (periodic), f[i+1] - f[i-1], 
+    shared by :func:`damping_coefficient` and :func:`chord_jacobian`.
+
+    :param u: Wind along the first dimension, (Nx, Ny) or (Ne, Nx, Ny) for an ensemble
+    :type u: ndarray
+    :param v: Wind along the second dimension
+    :type v: ndarray
+    :param workspace: If given, the differences are written in its buffers, defaults to None (new arrays)
+    :type workspace: :class:`Workspace` object, optional
+    :return: The differences of u along the first and the second dimension, then the ones of v
+    :rtype: tuple of ndarray
+    """
+    def difference(f, axis, name):
+        out = np.empty(f.shape, f.dtype) if workspace is None else workspace.buffer(name, f.shape, f.dtype)
+        if f.shape[axis] < 3:
+            return np.subtract(np.roll(f,-1,axis), np.roll(f,1,axis), out=out)
+        # same values as np.roll(f,-1,axis) - np.roll(f,1,axis), without the copies
+        f = np.moveaxis(f, axis, 0)
+        o = np.moveaxis(out, axis, 0)
+        np.subtract(f[2:], f[:-2], out=o[1:-1])
+        np.subtract(f[1], f[-1], out=o[0])
+        np.subtract(f[0], f[-2], out=o[-1])
+        return out
+    return (difference(u, -2, 'du_x'), difference(u, -1, 'du_y'),
+            difference(v, -2, 'dv_x'), difference(v, -1, 'dv_y'))
+
+def damping_coefficient(u, v, dt, dx, dy, interp_backend='numpy', differences=None):
+    """ Relaxation coefficient kappa of the 'damped_bicubic' method, computed from the deformation of the wind.
+
+    :param u: Wind along the first dimension, (Nx, Ny) or (Ne, Nx, Ny) for an ensemble
+    :type u: ndarray
+    :param v: Wind along the second dimension
+    :type v: ndarray
+    :param dt: Time step
+    :type dt: float
+    :param dx: Grid step along the first dimension
+    :type dx: float
+    :param dy: Grid step along the second dimension
+    :type dy: float
+    :param interp_backend: 'numpy' or 'numba' (compiled kernel, if Numba is installed), defaults to 'numpy'
+    :type interp_backend: str, optional
+    :param differences: Centered differences of the wind given by :func:`wind_differences`, defaults to None (computed)
+    :type differences: tuple of ndarray, optional
+    :return: kappa, between 0 (bicubic interpolation) and 1 (linear interpolation)
+    :rtype: ndarray
+    """
+    a = 0.5
+    B = 4.0
+    d0 = 3.25E-5
+    if jit_kernels.use_jit(interp_backend):
+        # the kernel handles one member of an ensemble at a time
+        kappa = np.empty(u.shape, dtype=u.dtype)
+        for um, vm, km in zip(u.reshape((-1,) + u.shape[-2:]), v.reshape((-1,) + v.shape[-2:]),
+                              kappa.reshape((-1,) + u.shape[-2:])):
+            jit_kernels.damping_coefficient(np.ascontiguousarray(um), np.ascontiguousarray(vm),
+                                            dx, dy, dt, a, B, d0, km)
+        return kappa
+
+    # the last two axes are the grid (a leading axis holds the members of an ensemble)
+    du_x, du_y, dv_x, dv_y = differences if differences is not None else wind_differences(u, v)
+    # d = 0.5 * sqrt((du/dx - dv/dy)**2 + (du/dy + dv/dx)**2), computed in place
+    d = np.divide(du_x, 2 * dx)
+    tmp = np.divide(dv_y, 2 * dy)
+    d -= tmp
+    np.square(d, out=d)
+    s2 = np.divide(du_y, 2 * dy)
+    s2 += np.divide(dv_x, 2 * dx, out=tmp)
+    d += np.square(s2, out=s2)
+    np.sqrt(d, out=d)
+    d *= 0.5
+    d2 = np.divide(d, d0, out=s2)
+    np.maximum(d2, 1, out=d2)
+    np.power(d2, B, out=d2)
+    # f = a * d * d2**B, then f * dt / (1 + f * dt)
+    f = np.multiply(a, d, out=d)
+    f *= d2
+    f *= dt
+    return np.divide(f, np.add(1, f, out=tmp), out=f)
+
+def chord_jacobian(u, v, c, differences=None):
+    """ Inverse of I - J at each grid point, J being the Jacobian of the iteration alpha -> c * wind(x - alpha)
+    of :func:`advection_step_3P` (alpha in grid cells), approximated by the centered differences of the wind
+    at the grid points. Where I - J is nearly singular, the identity is returned (fixed point iteration).
+
+    :param u: Wind along the first dimension
+    :type u: ndarray
+    :param v: Wind along the second dimension
+    :type v: ndarray
+    :param c: Ratio dt/dx converting the wind into a displacement in grid cells
+    :type c: float
+    :param differences: Centered differences of the wind given by :func:`wind_differences`, defaults to None (computed)
+    :type differences: tuple of ndarray, optional
+    :return: Inverse matrices, of shape (2, 2) + u.shape
+    :rtype: ndarray
+    """
+    # I - J = I + c * grad(wind), the gradient being taken with respect to the grid indices
+    du_x, du_y, dv_x, dv_y = differences if differences is not None else wind_differences(u, v)
+    m = np.array([[1 + c * du_x / 2, c * du_y / 2],
+                  [c * dv_x / 2, 1 + c * dv_y / 2]])
+    det = m[0,0] * m[1,1] - m[0,1] * m[1,0]
+    regular = np.abs(det) > 1e-3
+    det = np.where(regular, det, 1)
+    inverse = np.array([[m[1,1] / det, -m[0,1] / det], [-m[1,0] / det, m[0,0] / det]])
+    return np.where(regular, inverse, np.eye(2).reshape((2, 2) + (1,) * u.ndim))
 
 def advection_step_3P(alpha_u_minus, alpha_v_minus, field_minus,
                       dt, u, v, dx, dy,
                       alpha_method,
                       order_alpha,
                       F_method,
-                      verbose=0):
+                      verbose=0,
+                      interp_backend='numpy',
+                      interp_workers=1,
+                      alpha_tol=None,
+                      alpha_solver='fixed_point',
+                      stats=None,
+                      out=None,
+                      decomposition=None):
+    """ Semi-Lagrangian advection of a field over two time steps (three time levels scheme).
+    The displacement alpha of the step is estimated iteratively from the one of the previous step,
+    then the field at time t-dt is interpolated at the locations x - 2 alpha.
+
+    :param alpha_u_minus: Displacement along the first dimension at the previous step, in grid cells
+    :type alpha_u_minus: ndarray
+    :param alpha_v_minus: Displacement along the second dimension at the previous step
+    :type alpha_v_minus: ndarray
+    :param field_minus: Field at time t-dt (a vectorial field has a leading axis)
+    :type field_minus: ndarray
+    :param dt: Time step
+    :type dt: float
+    :param u: Wind along the first dimension at time t
+    :type u: ndarray
+    :param v: Wind along the second dimension at time t
+    :type v: ndarray
+    :param dx: Grid step along the first dimension
+    :type dx: float
+    :param dy: Grid step along the second dimension
+    :type dy: float
+    :param alpha_method: Interpolation method of the wind for the displacement ('linear', 'bicubic', 'damped_bicubic', ...)
+    :type alpha_method: str
+    :param order_alpha: Number of iterations of the estimation of the displacement (maximum number with alpha_tol). \
+        Without alpha_tol, the iterations before the last one use linear interpolation
+    :type order_alpha: int
+    :param F_method: Interpolation method of the field
+    :type F_method: str
+    :param verbose: verbose, defaults to 0
+    :type verbose: int, optional
+    :param interp_backend: 'numpy' or 'numba', see :class:`InterpolationPlan`, defaults to 'numpy'
+    :type interp_backend: str, optional
+    :param interp_workers: Number of threads of the numpy interpolation, see :class:`InterpolationPlan`, defaults to 1
+    :type interp_workers: int, optional
+    :param alpha_tol: If given, every iteration uses alpha_method and the iterations stop as soon as the displacement \
+        changes by less than alpha_tol grid cells at every point (at most order_alpha iterations). The members of an \
+        ensemble converge separately: the displacement of a converged member is no longer updated, defaults to None
+    :type alpha_tol: float, optional
+    :param alpha_solver: 'fixed_point' (the next estimate is the wind interpolated at the last one) or 'newton' \
+        (chord Newton method: the correction is divided by I - J, the Jacobian J of the iteration being \
+        approximated by the wind gradients at the grid points, see :func:`chord_jacobian`). 'newton' \
+        needs no more interpolation per iteration and fewer iterations to converge, defaults to 'fixed_point'
+    :type alpha_solver: str, optional
+    :param stats: If given, the number of iterations done and the last change of the displacement (in grid cells) are \
+        appended to its lists 'iterations' and 'residuals', as lists over the members for an ensemble, defaults to None
+    :type stats: dictionary, optional
+    :param out: Array where the advected field is written, defaults to None (new array)
+    :type out: ndarray, optional
+    :param decomposition: Decomposition of the grid of a distributed run: the arrays are then the rows of the process, and \
+        the interpolations use halos of the adjacent slabs as wide as the largest displacement (see :mod:`profitroll.core.distributed`), defaults to None
+    :type decomposition: :class:`SlabDecomposition` object, optional
+    :raises "Unknown solver for the displacement": Invalid alpha_solver
+    :return: The displacements along both dimensions and the advected field
+    :rtype: tuple of ndarray
+    """
+    if alpha_solver not in ('fixed_point', 'newton'):
+        raise Exception('Unknown solver for the displacement: ' + alpha_solver)
     
-    if alpha_method == 'damped_bicubic' or F_method == 'damped_bicubic':
-         a = 0.5
-         B = 4.0
-         d0 = 3.25E-5
-         d = 0.5 * np.sqrt(
-             np.square( (np.roll(u,-1,0) - np.roll(u,1,0)) / (2 * dx)   - \
-                        (np.roll(v,-1,1) - np.roll(v,1,1)) / (2 * dy) ) + \
-             np.square( (np.roll(u,-1,1) - np.roll(u,1,1)) / (2 * dy)   + \
-                        (np.roll(v,-1,0) - np.roll(v,1,0)) / (2 * dx) ) )
-         d2 = (d.copy())/d0
-         d2[np.where(d2<1)] = 1
-         f = a * d * d2**B
-         kappa = f * dt / (1 + f * dt)
+    # the stencils and the intermediate interpolations are written in the
+    # scratch buffers of the grid, reused from one call to the next
+    workspace = get_workspace(u.shape[-2:])
+
+    # The deformation of the wind (kappa) and its gradient (newton solver) 
+    # are computed once, from the same differences. The compiled kernel of
+    # kappa computes its own differences, on whole grids only.
+    damped = alpha_method == 'damped_bicubic' or F_method == 'damped_bicubic'
+    kappa_backend = interp_backend if decomposition is None else 'numpy'
+    differences = None
+    if alpha_solver == 'newton' or (damped and not jit_kernels.use_jit(kappa_backend)):
+        if decomposition is None:
+            differences = wind_differences(u, v, workspace)
+        else:
+            # the boundary rows need a row of the adjacent slabs
+            u_halo, v_halo = decomposition.halo(np.array([u,v]), 1)
+            differences = tuple(d[...,1:-1,:] for d in wind_differences(u_halo, v_halo))
+    kappa = None
+    if damped:
+         kappa = damping_coefficient(u, v, dt, dx, dy, kappa_backend, differences)
          print("kappa: ", np.mean(kappa)," , ", np.min(kappa)," , ", np.max(kappa)) if verbose > 2 else None 
         
     # ITERATIVE ESTIMATION OF THE DISPLACEMENT-------------------------------
@@ -29,6 +207,15 @@ def advection_step_3P(alpha_u_minus, alpha_v_minus, field_minus,
     # in x -alpha_minus, where alpha is the previous estimate. At each time
     # step, a number of iterations order_alpha is used, and the iterative 
     # scheme is initialized with the estimate at the previous time step.
+    wind = np.array([u,v])
+    alpha_minus = np.array([alpha_u_minus, alpha_v_minus])
+    wind_dtype = np.result_type(wind.dtype, alpha_minus.dtype, np.float32)
+    if alpha_solver == 'newton':
+        inverse = chord_jacobian(u, v, dt/dx, differences)
+    # the convergence is tested for each member of an ensemble (shape () without ensemble)
+    members = alpha_minus.shape[1:-2]
+    converged = np.zeros(members, dtype=bool)
+    iterations = np.zeros(members, dtype=int)
     for k in range(order_alpha):
         # Staniforth et Al. states that for the interpolation of the 
         # estimated displacement, linear interpolation is usually 
@@ -36,7 +223,8 @@ def advection_step_3P(alpha_u_minus, alpha_v_minus, field_minus,
         # expensive. Damped bicubic interpolation also combines the accuracy 
         # of bicubic interpolation with a relaxation based on the linear 
         # interpolation to limit small scale numerical noise.
-        if k < order_alpha-1 and alpha_method !='linear':
+        # With a tolerance, any iteration may be the last one.
+        if k < order_alpha-1 and alpha_method !='linear' and alpha_tol is None:
             method = 'linear'
         else:
             method = alpha_method
@@ -44,20 +232,41 @@ def advection_step_3P(alpha_u_minus, alpha_v_minus, field_minus,
         print("      advection_step_3P with alpha order "+str(k)+" and method "\
               +method) if verbose > 2 else None
         
-        if method == 'damped_bicubic':
-            [alpha_u, alpha_v] = (dt/dx)* ( 
-                kappa * upstream_interp(alpha_u_minus, alpha_v_minus, 
-                        np.array([u,v]), method='linear',verbose=verbose ) 
-                + (1- kappa) * upstream_interp(alpha_u_minus, alpha_v_minus, 
-                            np.array([u,v]), method='bicubic',verbose=verbose))
+        # 'damped_bicubic' yields kappa * linear + (1 - kappa) * bicubic 
+        # from a single gather of the bicubic stencil.
+        halo = decomposition.halo_width(alpha_minus) if decomposition is not None else 0
+        plan = InterpolationPlan(alpha_minus[0], alpha_minus[1], verbose=verbose, backend=interp_backend,
+                                 workers=interp_workers, workspace=workspace, kappa=kappa, halo=halo)
+        wind_int = plan(wind if not halo else decomposition.halo(wind, halo), method=method,
+                        out=workspace.buffer('wind_int', wind.shape, wind_dtype))
+        alpha = (dt/dx)*wind_int
+        iterations += ~converged
+
+        # In quiescent regions, the estimate of the previous step is
+        # already converged and the next iterations are not needed.
+        residual = alpha - alpha_minus
+        change = np.max(np.abs(residual), axis=(0, -2, -1))
+        if decomposition is not None:
+            change = decomposition.max(change)
+        print("      change of the displacement: ", change) if verbose > 2 else None
+        if alpha_tol is not None:
+            converged = change < alpha_tol
+            if np.all(converged):
+                break
+        if alpha_solver == 'newton':
+            alpha_plus = alpha_minus + np.einsum('ij...,j...->i...', inverse, residual)
         else:
-            [alpha_u, alpha_v] = (dt/dx)*upstream_interp(alpha_u_minus,
-                                                     alpha_v_minus,
-                                                     np.array([u,v]),
-                                                     method=method,
-                                                     verbose=verbose)
-        alpha_u_minus = alpha_u
-        alpha_v_minus = alpha_v
+            alpha_plus = alpha
+        # a converged member keeps its displacement: interpolating the
+        # wind there again yields the same alpha as when it converged
+        if np.any(converged):
+            alpha_plus = np.where(converged[..., None, None], alpha_minus, alpha_plus)
+        alpha_minus = alpha_plus
+
+    if stats is not None:
+        stats.setdefault('iterations', []).append(iterations.tolist())
+        stats.setdefault('residuals', []).append(change.tolist())
+    alpha_u, alpha_v = alpha
         
 #------------------------------------------------------------------------
     
@@ -66,16 +275,9 @@ def advection_step_3P(alpha_u_minus, alpha_v_minus, field_minus,
     #field_plus = upstream_interp(2*alpha_u, 2*alpha_v, field_minus,
     #                             method=F_method, verbose=verbose)
 
-    if F_method == 'damped_bicubic':
-        Ia = upstream_interp(2*alpha_u, 2*alpha_v, field_minus,
-                                        method='bicubic',verbose=verbose )
-        Id = upstream_interp(2*alpha_u, 2*alpha_v, field_minus,
-                                        method='linear',verbose=verbose )
-        field_plus =  kappa * Id +(1- kappa)* Ia 
-
- 
-    else:
-        field_plus = upstream_interp(2*alpha_u, 2*alpha_v, field_minus,
-                                        method=F_method, verbose=verbose )
+    halo = decomposition.halo_width(2*alpha) if decomposition is not None else 0
+    plan = InterpolationPlan(2*alpha_u, 2*alpha_v, verbose=verbose, backend=interp_backend,
+                             workers=interp_workers, workspace=workspace, kappa=kappa, halo=halo)
+    field_plus = plan(field_minus if not halo else decomposition.halo(field_minus, halo), method=F_method, out=out)
     
     return alpha_u, alpha_v, field_plus
\ No newline at end of file
@@ -7,4 +7,5 @@ def end_pop(history, **kwargs):
     assert history.size > 0
     history.pop(0)
 
-		
+# variables read or written by the method (see the load_variables argument of Simulation)
+end_pop.variables = []
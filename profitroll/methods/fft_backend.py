@@ -0,0 +1,168 @@
+import numpy as np
+
+class NumpyFFT():
+    """ This class encodes the default FFT backend, based on :mod:`numpy.fft` (single-threaded).
+
+    Every backend provides the real transforms used by the spectral methods (:meth:`rfft2` and
+    :meth:`irfft2`) and :meth:`fast_len`, which gives the smallest transform length larger
+    than a given size that is handled efficiently.
+    """
+    name = 'numpy'
+
+    def rfft2(self, x):
+        """ Real forward transform over the last two axes
+
+        :param x: Real field
+        :type x: ndarray
+        :return: Half spectrum of the field
+        :rtype: ndarray
+        """
+        return np.fft.rfft2(x)
+
+    def irfft2(self, X, s):
+        """ Inverse of :meth:`rfft2`
+
+        :param X: Half spectrum
+        :type X: ndarray
+        :param s: Shape of the real output
+        :type s: tuple of int
+        :return: Real field
+        :rtype: ndarray
+        """
+        return np.fft.irfft2(X, s=s)
+
+    def fast_len(self, n):
+        """ Smallest 5-smooth integer (only 2, 3 and 5 as prime factors) larger or equal to n
+
+        :param n: Size of the grid
+        :type n: int
+        :rtype: int
+        """
+        m = n
+        while True:
+            k = m
+            for p in (2, 3, 5):
+                while k % p == 0:
+                    k //= p
+            if k == 1:
+                return m
+            m += 1
+
+class ScipyFFT(NumpyFFT):
+    """ FFT backend based on :mod:`scipy.fft`, which is multi-threaded and keeps single precision inputs in single precision.
+
+    :param workers: Number of threads used for each transform, defaults to None (all the available cores)
+    :type workers: int, optional
+    """
+    name = 'scipy'
+
+    def __init__(self, workers=None):
+        """ Constructor method
+        """
+        import scipy.fft
+        self._fft = scipy.fft
+        self.workers = workers if workers is not None else -1
+
+    def rfft2(self, x):
+        return self._fft.rfft2(x, workers=self.workers)
+
+    def irfft2(self, X, s):
+        return self._fft.irfft2(X, s=s, workers=self.workers)
+
+    def fast_len(self, n):
+        return self._fft.next_fast_len(n, real=True)
+
+class FFTWFFT(NumpyFFT):
+    """ FFT backend based on pyFFTW. One FFTW plan is built for each shape and type of
+    transform and is reused afterwards. The wisdom accumulated by FFTW can be stored in a file
+    and reloaded so that the plans of a later run are created quickly.
+
+    :param workers: Number of threads used for each transform, defaults to None (all the available cores)
+    :type workers: int, optional
+    :param planner_effort: FFTW planner flag, defaults to 'FFTW_MEASURE'
+    :type planner_effort: str, optional
+    :param wisdom_file: Path of a file where the FFTW wisdom is loaded from (if it exists) and saved to by :meth:`save_wisdom`, defaults to None
+    :type wisdom_file: str, optional
+    """
+    name = 'pyfftw'
+
+    def __init__(self, workers=None, planner_effort='FFTW_MEASURE', wisdom_file=None):
+        """ Constructor method
+        """
+        import os
+        import pickle
+        import pyfftw
+        self._pyfftw = pyfftw
+        self.workers = workers if workers is not None else os.cpu_count()
+        self.planner_effort = planner_effort
+        self.wisdom_file = wisdom_file
+        self._plans = {}
+        if wisdom_file is not None and os.path.exists(wisdom_file):
+            with open(wisdom_file, 'rb') as handle:
+                pyfftw.import_wisdom(pickle.load(handle))
+
+    def _plan(self, kind, x, s=None):
+        key = (kind, x.shape, x.dtype, s)
+        plan = self._plans.get(key)
+        if plan is None:
+            builder = self._pyfftw.builders.rfft2 if kind == 'r2c' else self._pyfftw.builders.irfft2
+            kwargs = {} if s is None else {'s': s}
+            plan = builder(self._pyfftw.empty_aligned(x.shape, dtype=x.dtype), threads=self.workers,
+                           planner_effort=self.planner_effort, **kwargs)
+            self._plans[key] = plan
+        return plan
+
+    def rfft2(self, x):
+        # the output array of a plan is reused at each call, thus it is copied
+        return self._plan('r2c', x)(x).copy()
+
+    def irfft2(self, X, s):
+        return self._plan('c2r', X, tuple(s))(X).copy()
+
+    def fast_len(self, n):
+        return self._pyfftw.next_fast_len(n)
+
+    def save_wisdom(self):
+        """ Saves the FFTW wisdom in wisdom_file
+        """
+        import pickle
+        if self.wisdom_file is not None:
+            with open(self.wisdom_file, 'wb') as handle:
+                pickle.dump(self._pyfftw.export_wisdom(), handle)
+
+backends = {'numpy': NumpyFFT, 'scipy': ScipyFFT, 'pyfftw': FFTWFFT}
+
+_default_backend = NumpyFFT()
+
+def get_backend(backend=None, **kwargs):
+    """ Returns an FFT backend object
+
+    :param backend: Name of the backend ('numpy', 'scipy' or 'pyfftw') or backend object, defaults to None (numpy backend)
+    :type backend: str or backend object, optional
+    :param kwargs: Arguments of the backend constructor (workers, ...)
+    :raises "Unknown FFT backend": Invalid string as a backend name
+    :return: The backend
+    :rtype: backend object
+    """
+    if backend is None:
+        return _default_backend
+    if not isinstance(backend, str):
+        return backend
+    try:
+        return backends[backend](**kwargs)
+    except KeyError:
+        raise Exception("Unknown FFT backend: " + backend)
+
+def fast_grid_size(n, backend=None):
+    """ Smallest grid size larger or equal to n for which the transforms of the given backend are fast.
+    It can be used to choose Nx and Ny before creating the initial netCDF file. As the domain is
+    periodic, fields cannot be padded without changing the solution: the grid itself must have
+    a fast size.
+
+    :param n: Wished number of cells
+    :type n: int
+    :param backend: see :func:`get_backend`, defaults to None
+    :type backend: str or backend object, optional
+    :rtype: int
+    """
+    return get_backend(backend).fast_len(n)
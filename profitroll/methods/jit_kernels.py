@@ -0,0 +1,175 @@
+import numpy as np
+
+# Compiled (Numba) kernels of the semi-Lagrangian interpolation. Each kernel 
+# computes the indices and weights of the upstream points on the fly and 
+# accumulates the interpolated value in a single pass, the rows of the grid 
+# being processed in parallel. The field F can have halo more rows than the 
+# output on both sides (see the halo argument of InterpolationPlan).
+# Numba is an optional dependency: when it is not installed, has_numba is 
+# False and the numpy implementations are used.
+
+try:
+    import numba
+    has_numba = True
+except ImportError:
+    has_numba = False
+
+if has_numba:
+
+    @numba.njit(cache=True, inline='always')
+    def _catmull_rom(t):
+        t2 = t * t
+        t3 = t2 * t
+        return (-0.5 * t + t2 - 0.5 * t3,
+                1 - 2.5 * t2 + 1.5 * t3,
+                0.5 * t + 2 * t2 - 1.5 * t3,
+                -0.5 * t2 + 0.5 * t3)
+
+    @numba.njit(parallel=True, cache=True)
+    def interp_linear(alpha_x, alpha_y, F, out):
+        dim, Nx, Ny = F.shape
+        halo = (Nx - out.shape[1]) // 2
+        for x in numba.prange(out.shape[1]):
+            for y in range(Ny):
+                xi = (x + halo - alpha_x[x, y]) % Nx
+                yi = (y - alpha_y[x, y]) % Ny
+                xt = np.ceil(xi)
+                yt = np.ceil(yi)
+                xc = xt - xi
+                yc = yt - yi
+                x1 = int(xt) % Nx
+                y1 = int(yt) % Ny
+                x0 = (x1 - 1) % Nx
+                y0 = (y1 - 1) % Ny
+                w00 = xc * yc
+                w01 = xc * (1 - yc)
+                w11 = (1 - xc) * (1 - yc)
+                w10 = (1 - xc) * yc
+                for d in range(dim):
+                    out[d, x, y] = w00 * F[d, x0, y0] + w01 * F[d, x0, y1] \
+                                 + w11 * F[d, x1, y1] + w10 * F[d, x1, y0]
+
+    @numba.njit(cache=True, inline='always')
+    def _diffusive_point(p, q, alpha_x, alpha_y, Nx, Ny):
+        return (int(np.ceil(p - alpha_x[p, q])) % Nx,
+                int(np.ceil(q - alpha_y[p, q])) % Ny)
+
+    @numba.njit(parallel=True, cache=True)
+    def interp_diffusive(alpha_x, alpha_y, F, out):
+        dim, Nx, Ny = F.shape
+        for x in numba.prange(Nx):
+            xm = (x - 1) % Nx
+            for y in range(Ny):
+                ym = (y - 1) % Ny
+                xi = x - alpha_x[x, y]
+                yi = y - alpha_y[x, y]
+                xc = np.ceil(xi) - xi
+                yc = np.ceil(yi) - yi
+                # the gathered field is shifted by one point (see upstream_interp)
+                a0, b0 = _diffusive_point(xm, ym, alpha_x, alpha_y, Nx, Ny)
+                a1, b1 = _diffusive_point(xm, y, alpha_x, alpha_y, Nx, Ny)
+                a2, b2 = _diffusive_point(x, y, alpha_x, alpha_y, Nx, Ny)
+                a3, b3 = _diffusive_point(x, ym, alpha_x, alpha_y, Nx, Ny)
+                w00 = xc * yc
+                w01 = xc * (1 - yc)
+                w11 = (1 - xc) * (1 - yc)
+                w10 = (1 - xc) * yc
+                for d in range(dim):
+                    out[d, x, y] = w00 * F[d, a0, b0] + w01 * F[d, a1, b1] \
+                                 + w11 * F[d, a2, b2] + w10 * F[d, a3, b3]
+
+    @numba.njit(parallel=True, cache=True)
+    def interp_bicubic(alpha_x, alpha_y, F, out):
+        dim, Nx, Ny = F.shape
+        halo = (Nx - out.shape[1]) // 2
+        for x in numba.prange(out.shape[1]):
+            for y in range(Ny):
+                xb = x + halo - alpha_x[x, y]
+                yb = y - alpha_y[x, y]
+                xf = np.floor(xb)
+                yf = np.floor(yb)
+                wx = _catmull_rom(xb - xf)
+                wy = _catmull_rom(yb - yf)
+                ix = int(xf) - 1
+                iy = int(yf) - 1
+                for d in range(dim):
+                    acc = 0.
+                    for i in range(4):
+                        xs = (ix + i) % Nx
+                        row = 0.
+                        for j in range(4):
+                            row += wy[j] * F[d, xs, (iy + j) % Ny]
+                        acc += wx[i] * row
+                    out[d, x, y] = acc
+
+    @numba.njit(parallel=True, cache=True)
+    def interp_damped_bicubic(alpha_x, alpha_y, F, out, kappa):
+        # bicubic and linear (central points of the bicubic stencil) 
+        # estimates accumulated together, then blended with kappa
+        dim, Nx, Ny = F.shape
+        halo = (Nx - out.shape[1]) // 2
+        for x in numba.prange(out.shape[1]):
+            for y in range(Ny):
+                xb = x + halo - alpha_x[x, y]
+                yb = y - alpha_y[x, y]
+                xf = np.floor(xb)
+                yf = np.floor(yb)
+                tx = xb - xf
+                ty = yb - yf
+                wx = _catmull_rom(tx)
+                wy = _catmull_rom(ty)
+                ix = int(xf) - 1
+                iy = int(yf) - 1
+                y1 = (iy + 1) % Ny
+                y2 = (iy + 2) % Ny
+                k = kappa[x, y]
+                for d in range(dim):
+                    acc = 0.
+                    lin = 0.
+                    for i in range(4):
+                        xs = (ix + i) % Nx
+                        row = 0.
+                        for j in range(4):
+                            row += wy[j] * F[d, xs, (iy + j) % Ny]
+                        acc += wx[i] * row
+                        if i == 1:
+                            lin += (1 - tx) * ((1 - ty) * F[d, xs, y1] + ty * F[d, xs, y2])
+                        elif i == 2:
+                            lin += tx * ((1 - ty) * F[d, xs, y1] + ty * F[d, xs, y2])
+                    out[d, x, y] = acc + k * (lin - acc)
+
+    @numba.njit(parallel=True, cache=True)
+    def damping_coefficient(u, v, dx, dy, dt, a, B, d0, out):
+        Nx, Ny = u.shape
+        for x in numba.prange(Nx):
+            xp = (x + 1) % Nx
+            xm = (x - 1) % Nx
+            for y in range(Ny):
+                yp = (y + 1) % Ny
+                ym = (y - 1) % Ny
+                s1 = (u[xp, y] - u[xm, y]) / (2 * dx) - (v[x, yp] - v[x, ym]) / (2 * dy)
+                s2 = (u[x, yp] - u[x, ym]) / (2 * dy) + (v[xp, y] - v[xm, y]) / (2 * dx)
+                d = 0.5 * np.sqrt(s1 * s1 + s2 * s2)
+                d2 = max(d / d0, 1.)
+                f = a * d * d2**B
+                out[x, y] = f * dt / (1 + f * dt)
+
+    interp_kernels = {'linear': interp_linear,
+                      'diffusive': interp_diffusive,
+                      'bicubic': interp_bicubic,
+                      'damped_bicubic': interp_damped_bicubic}
+else:
+    interp_kernels = {}
+
+def use_jit(backend):
+    """ Tells whether the compiled kernels must be used for a given backend name
+
+    :param backend: 'numpy' or 'numba'
+    :type backend: str
+    :raises "Unknown interpolation backend": Invalid string as a backend name
+    :return: True if backend is 'numba' and Numba is installed (otherwise the numpy implementations are used)
+    :rtype: bool
+    """
+    if backend not in ('numpy', 'numba'):
+        raise Exception("Unknown interpolation backend: " + backend)
+    return backend == 'numba' and has_numba
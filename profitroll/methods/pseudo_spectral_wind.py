@@ -1,6 +1,6 @@
-from .spectral import geostwind
+from .spectral import geostwind, state_spectrum
 
-def pseudo_spectral_wind(history, grid, params, verbose, **kwargs):
+def pseudo_spectral_wind(history, grid, params, verbose, fft_backend=None, **kwargs):
     """Wrap the spectral methods to fit the architecture.
     
     :param history: Current history of state
@@ -11,14 +11,21 @@ def pseudo_spectral_wind(history, grid, params, verbose, **kwargs):
     :type params: dictionary 
     :param verbose: verbose, defaults to 0
     :type verbose: int, optional
+    :param fft_backend: FFT backend of the simulation, defaults to None (numpy)
+    :type fft_backend: backend object, optional
     """
     assert history.size > 0
     current_state = history.state_list[-1]
     
-    ut, vt = geostwind(grid.Lx, grid.Ly, current_state.vrs['theta_t'], params, z=0, verbose=verbose)
-    us, vs = geostwind(grid.Lx, grid.Ly, current_state.vrs['theta_t'], params, z=params['z_star'], verbose=verbose)
+    # the spectrum of theta_t is shared by both levels (and kept in the state for wrap_wv)
+    thetahat = state_spectrum(current_state, 'theta_t', backend=fft_backend)
+    ut, vt = geostwind(grid.Lx, grid.Ly, current_state.vrs['theta_t'], params, z=0, verbose=verbose, thetatphat=thetahat, backend=fft_backend)
+    us, vs = geostwind(grid.Lx, grid.Ly, current_state.vrs['theta_t'], params, z=params['z_star'], verbose=verbose, thetatphat=thetahat, backend=fft_backend)
     
     current_state.vrs['ut'] = ut
     current_state.vrs['vt'] = vt
     current_state.vrs['us'] = us
-    current_state.vrs['vs'] = vs
\ No newline at end of file
+    current_state.vrs['vs'] = vs
+
+# variables read or written by the method (see the load_variables argument of Simulation)
+pseudo_spectral_wind.variables = ['theta_t', 'ut', 'vt', 'us', 'vs']
@@ -11,4 +11,6 @@ def same_wind(history, **kwargs):
     update_var = ['ut','vt','us','vs']
     for var in update_var:
         current_state.vrs[var] = previous_state.vrs[var]
-		
+
+# variables read or written by the method (see the load_variables argument of Simulation)
+same_wind.variables = ['ut', 'vt', 'us', 'vs']
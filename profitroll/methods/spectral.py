@@ -1,86 +1,228 @@
 import numpy as np
+from collections import OrderedDict
+
+from .fft_backend import get_backend
+from ..core.tracing import traced
+
+# Maximum number of spectral operators kept in memory. When it is exceeded,
+# the least recently used operator is evicted.
+max_cached_operators = 16
+_operator_cache = OrderedDict()
+
+class SpectralOperator():
+    """ This class encodes the spectral quantities needed by :func:`geostwind` and :func:`vertwind`
+    for a given grid, altitude and set of physical parameters. They only depend on these
+    inputs so they are computed once and reused at each call.
+
+    The fields are real, thus only the half spectrum returned by :func:`spectrum` is stored
+    (the second axis holds the non-negative frequencies).
+
+    :param a: Length of the domain along the first axis
+    :type a: float
+    :param b: Length of the domain along the second axis
+    :type b: float
+    :param shape: Shape (Pa, Pb) of the physical grid
+    :type shape: tuple of int
+    :param params: Dictionary of the physical parameters (theta_00, g, N_s, N_t)
+    :type params: dictionary
+    :param z: Altitude of the level, defaults to 0
+    :type z: float, optional
+    :param dtype: Floating point type of the fields, defaults to float64. The operators are stored in the matching precision
+    :type dtype: numpy dtype, optional
+    :param columns: Columns of the half spectrum where the operators are computed, for the spectra of a distributed run (see :class:`DistributedFFT`), defaults to None (all of them)
+    :type columns: slice, optional
+    """
+    def __init__(self, a, b, shape, params, z=0, dtype=np.float64, columns=None):
+        """ Constructor method
+        """
+        f       = 1e-4
+        theta00 = params['theta_00']
+        g       = params['g']
+        Ns      = params['N_s']
+        Nt      = params['N_t']
+        N       = Ns if z>0 else Nt
+        pate    = g*(Ns-Nt)/(theta00*Ns*Nt)
+
+        Pa, Pb = shape
+        self.shape = (Pa, Pb)
+        self.N = N
+
+        columns = columns if columns is not None else slice(None)
+        freqx = np.fft.fftfreq(Pa, a/Pa)
+        freqy = np.fft.rfftfreq(Pb, b/Pb)[columns]
+
+        vecFreqX = 2*np.pi*freqx
+        vecFreqY = 2*np.pi*freqy
+
+        # wavenumber grids
+        self.KmatX, self.KmatY = np.meshgrid(vecFreqX, vecFreqY, indexing='ij')
+        Kmat = np.sqrt(self.KmatX**2 + self.KmatY**2)
+        Kmat[np.where(Kmat==0)]=float('Inf') # set to inf. null wavenumbers
+
+        # inverse-Laplacian transfer matrix (theta -> streamfunction)
+        self.Mat = pate/Kmat if (z==0) else pate/Kmat * np.exp(-N*Kmat/f*np.abs(z))
+
+        Kmat[np.where(np.isinf(Kmat))]=0 # set inf. elements back to 0
+        self.Kmat = Kmat
+
+        # derivative multipliers. The Nyquist modes of odd multipliers are
+        # dropped, as the real part of a full complex transform would do.
+        self.dx = 1j*self.KmatX
+        self.dy = 1j*self.KmatY
+        if Pa%2==0:
+            self.dx[Pa//2,:] = 0
+        if Pb%2==0:
+            self.dy[:,np.arange(Pb//2+1)[columns]==Pb//2] = 0
+
+        # theta -> vertical derivative of theta at level z
+        self.thetaz = theta00/g*(-np.sign(z))*N*Kmat*self.Mat
+
+        # operators in the precision of the fields
+        real = np.dtype(dtype)
+        cplx = np.result_type(real, np.complex64)
+        for name in ['KmatX', 'KmatY', 'Kmat', 'Mat', 'thetaz']:
+            setattr(self, name, getattr(self, name).astype(real, copy=False))
+        for name in ['dx', 'dy']:
+            setattr(self, name, getattr(self, name).astype(cplx, copy=False))
+
+def spectral_operator(a, b, shape, params, z=0, dtype=np.float64, columns=None):
+    """ Returns the :class:`SpectralOperator` associated to the given inputs, from the cache if it
+    has already been built.
+
+    :param a: Length of the domain along the first axis
+    :type a: float
+    :param b: Length of the domain along the second axis
+    :type b: float
+    :param shape: Shape (Pa, Pb) of the physical grid
+    :type shape: tuple of int
+    :param params: Dictionary of the physical parameters (theta_00, g, N_s, N_t)
+    :type params: dictionary
+    :param z: Altitude of the level, defaults to 0
+    :type z: float, optional
+    :param dtype: Floating point type of the fields, defaults to float64
+    :type dtype: numpy dtype, optional
+    :param columns: Columns of the half spectrum, see :class:`SpectralOperator`, defaults to None (all of them)
+    :type columns: slice, optional
+    :return: The spectral operator
+    :rtype: :class:`SpectralOperator` object
+    """
+    columns = columns if columns is not None else slice(None)
+    key = (tuple(shape), (columns.start, columns.stop), np.dtype(dtype).str, float(a), float(b), float(z),
+           float(params['theta_00']), float(params['g']), float(params['N_s']), float(params['N_t']))
+    try:
+        operator = _operator_cache[key]
+        _operator_cache.move_to_end(key)
+    except KeyError:
+        operator = SpectralOperator(a, b, shape, params, z, dtype, columns)
+        _operator_cache[key] = operator
+        while len(_operator_cache) > max_cached_operators:
+            _operator_cache.popitem(last=False)
+    return operator
+
+def clear_operator_cache():
+    """ Empties the cache of spectral operators
+    """
+    _operator_cache.clear()
+
+def grid_of(field, fft):
+    # Shape of the grid, columns of the spectra and decomposition of the grid: with
+    # a distributed backend (see distributed.py), the fields are slabs of rows
+    decomposition = getattr(fft, 'decomposition', None)
+    if decomposition is None:
+        return field.shape[-2:] + (None, None)
+    return decomposition.shape + (decomposition.columns, decomposition)
+
+@traced(category='spectral')
+def spectrum(thetatp, backend=None):
+    """ Real forward transform of a field. The result can be given to :func:`geostwind` and
+    :func:`vertwind` so that a field used several times is transformed only once.
+
+    :param thetatp: Field to transform
+    :type thetatp: ndarray
+    :param backend: FFT backend, see :func:`fft_backend.get_backend`, defaults to None (numpy)
+    :type backend: str or backend object, optional
+    :return: Half spectrum of the field
+    :rtype: ndarray
+    """
+    return get_backend(backend).rfft2(thetatp)
+
+def state_spectrum(state, var='theta_t', backend=None):
+    """ Spectrum of a variable of a :class:`State` object. It is memoized in the state, thus the
+    variable is transformed again only if it has been written since the last call.
+
+    :param state: State containing the variable
+    :type state: :class:`State` object
+    :param var: Name of the variable, defaults to 'theta_t'
+    :type var: str, optional
+    :param backend: FFT backend, see :func:`fft_backend.get_backend`, defaults to None (numpy)
+    :type backend: str or backend object, optional
+    :return: Half spectrum of the variable
+    :rtype: ndarray
+    """
+    fft = get_backend(backend)
+    return state.vrs.memoized(var, ('rfft2', fft.name), lambda field: spectrum(field, fft))
+
+@traced(category='spectral')
+def geostwind(a, b, thetatp, params, z=0, fourier=False, verbose=0, thetatphat=None, backend=None):
+
+    fft = get_backend(backend)
+    # the last two axes are the grid (a leading axis holds the members of an ensemble)
+    Pa, Pb, columns, decomposition = grid_of(thetatp, fft)
+    op = spectral_operator(a, b, (Pa, Pb), params, z, thetatp.dtype, columns)
+
+    if thetatphat is None:
+        thetatphat = fft.rfft2(thetatp)
+    psihat = thetatphat * op.Mat
 
-def geostwind(a, b, thetatp, params, z=0, fourier=False, verbose=0):
-    
-    f       = 1e-4
-    theta00 = params['theta_00']
-    g       = params['g']
-    Ns      = params['N_s']
-    Nt      = params['N_t']
-    N       = Ns if z>0 else Nt
-    pate    = g*(Ns-Nt)/(theta00*Ns*Nt)
-    
-    Pa, Pb = thetatp.shape
-    
-    thetatphat = np.fft.fft2(thetatp)
-    freqx = np.fft.fftfreq(Pa, a/Pa)
-    freqy = np.fft.fftfreq(Pb, b/Pb)
-    
-    vecFreqX = 2*np.pi*freqx
-    vecFreqY = 2*np.pi*freqy
-    
-    KmatX, KmatY = np.meshgrid(vecFreqX, vecFreqY)
-    Kmat = np.sqrt(KmatX**2 + KmatY**2).T
-    Kmat[np.where(Kmat==0)]=float('Inf')
-    
-    Mat = pate/Kmat if (z==0) else pate/Kmat * np.exp(-N*Kmat/f*np.abs(z))
-    psihat = thetatphat * Mat
-    
     if fourier:
-        ug = -np.fft.ifft2(psihat*1j*KmatY.T).real
-        vg = np.fft.ifft2(psihat*1j*KmatX.T).real
-    
+        ug = -fft.irfft2(psihat*op.dy, (Pa, Pb))
+        vg = fft.irfft2(psihat*op.dx, (Pa, Pb))
+
     else:
-        psi = np.fft.ifft2(psihat).real
-        ug = -(np.roll(psi,-1,1)-np.roll(psi,1,1))/(2*a/Pa)
-        vg = (np.roll(psi,-1,0)-np.roll(psi,1,0))/(2*b/Pb)
+        psi = fft.irfft2(psihat, (Pa, Pb))
+        ug = -(np.roll(psi,-1,-1)-np.roll(psi,1,-1))/(2*a/Pa)
+        if decomposition is None:
+            vg = (np.roll(psi,-1,-2)-np.roll(psi,1,-2))/(2*b/Pb)
+        else:
+            # the neighbouring rows belong to the adjacent slabs
+            psi = decomposition.halo(psi, 1)
+            vg = (psi[...,2:,:]-psi[...,:-2,:])/(2*b/Pb)
 
-    return ug, vg
+    # some backends always compute in double precision
+    return ug.astype(thetatp.dtype, copy=False), vg.astype(thetatp.dtype, copy=False)
 
-def vertwind(a, b, thetatp, thetatpprev, dt, params, z=0, verbose=0):
-    
-    f       = 1e-4
+@traced(category='spectral')
+def vertwind(a, b, thetatp, thetatpprev, dt, params, z=0, verbose=0, thetatphat=None, thetatpprevhat=None, backend=None):
+
+    fft = get_backend(backend)
     theta00 = params['theta_00']
     g       = params['g']
-    Ns      = params['N_s']
-    Nt      = params['N_t']
-    N       = Ns if z>0 else Nt
-    pate    = g*(Ns-Nt)/(theta00*Ns*Nt)
-    
-    Pa, Pb = thetatp.shape
-    
-    thetatphat = np.fft.fft2(thetatp)
-    thetatpprevhat = np.fft.fft2(thetatpprev)
-        
-    freqx = np.fft.fftfreq(Pa, a/Pa)
-    freqy = np.fft.fftfreq(Pb, b/Pb)
-    
-    vecFreqX = 2*np.pi*freqx
-    vecFreqY = 2*np.pi*freqy
-    
-    KmatX, KmatY = np.meshgrid(vecFreqX, vecFreqY)
-    Kmat = np.sqrt(KmatX**2 + KmatY**2).T
-    Kmat[np.where(Kmat==0)]=float('Inf') # set to inf. null wavenumbers
-    
-    Mat = pate/Kmat if (z==0) else pate/Kmat * np.exp(-N*Kmat/f*np.abs(z))
-    psihat     = thetatphat * Mat
-    psiprevhat = thetatpprevhat * Mat
-    
-    Kmat[np.where(np.isinf(Kmat))]=0 # set inf. elements back to 0
-    
-    thetazhat     = theta00/g*(-np.sign(z))*N*Kmat*psihat
-    thetazprevhat = theta00/g*(-np.sign(z))*N*Kmat*psiprevhat
-
-    ug = -np.fft.ifft2(psihat*1j*KmatY.T).real
-    vg =  np.fft.ifft2(psihat*1j*KmatX.T).real
-    
-    thetaz = np.fft.ifft2(thetazhat).real
-    thetazprev = np.fft.ifft2(thetazprevhat).real
-    dtthetaz = (thetaz-thetazprev)/dt
-    dxthetaz = np.fft.ifft2(thetazhat*1j*KmatX.T).real
-    dythetaz = np.fft.ifft2(thetazhat*1j*KmatY.T).real
-    
+
+    # the last two axes are the grid (a leading axis holds the members of an ensemble)
+    Pa, Pb, columns, _ = grid_of(thetatp, fft)
+    op = spectral_operator(a, b, (Pa, Pb), params, z, thetatp.dtype, columns)
+    N  = op.N
+
+    if thetatphat is None:
+        thetatphat = fft.rfft2(thetatp)
+    if thetatpprevhat is None:
+        thetatpprevhat = fft.rfft2(thetatpprev)
+
+    psihat = thetatphat * op.Mat
+
+    thetazhat     = thetatphat * op.thetaz
+    thetazprevhat = thetatpprevhat * op.thetaz
+
+    ug = -fft.irfft2(psihat*op.dy, (Pa, Pb))
+    vg =  fft.irfft2(psihat*op.dx, (Pa, Pb))
+
+    # the time derivative is linear: a single inverse transform is needed
+    dtthetaz = fft.irfft2(thetazhat-thetazprevhat, (Pa, Pb))/dt
+    dxthetaz = fft.irfft2(thetazhat*op.dx, (Pa, Pb))
+    dythetaz = fft.irfft2(thetazhat*op.dy, (Pa, Pb))
+
     w = -dtthetaz - ug*dxthetaz - vg*dythetaz
     w *= g/(N**2 * theta00)
-    
-    return w
+
+    # some backends always compute in double precision
+    return w.astype(thetatp.dtype, copy=False)
@@ -1,10 +1,440 @@
 import numpy as np
+from concurrent.futures import ThreadPoolExecutor
 
-def upstream_interp(alpha_x, alpha_y, F, method='linear', verbose=0, ho=0.15, **kwargs):
+from .jit_kernels import use_jit, interp_kernels
+from ..core.tracing import span
+
+_thread_pools = {}
+
+def thread_pool(workers):
+    """ Returns a pool of threads, shared by every interpolation using the same number of workers.
+
+    :param workers: Number of threads
+    :type workers: int
+    :rtype: ThreadPoolExecutor
+    """
+    if workers not in _thread_pools:
+        _thread_pools[workers] = ThreadPoolExecutor(max_workers=workers)
+    return _thread_pools[workers]
+
+def catmull_rom_weights(t, out=None, work=None):
+    """ Weights of the four points of the 1D cubic (Catmull-Rom) interpolation at the fractional positions t.
+
+    :param t: Fractional positions (between 0 and 1) with respect to the second point
+    :type t: ndarray
+    :param out: Four arrays of the shape of t where the weights are written, defaults to None (new arrays)
+    :type out: list of ndarray, optional
+    :param work: Three scratch arrays of the shape of t, needed with out, defaults to None
+    :type work: list of ndarray, optional
+    :return: The weights of the points -1, 0, 1 and 2
+    :rtype: list of ndarray
+    """
+    if out is None:
+        t2 = t * t
+        t3 = t2 * t
+        return [-0.5 * t + t2 - 0.5 * t3,
+                1 - 2.5 * t2 + 1.5 * t3,
+                0.5 * t + 2 * t2 - 1.5 * t3,
+                -0.5 * t2 + 0.5 * t3]
+
+    # same operations as above, written in the given arrays
+    [w0, w1, w2, w3] = out
+    [t2, t3, tmp] = work
+    np.multiply(t, t, out=t2)
+    np.multiply(t2, t, out=t3)
+    np.multiply(-0.5, t, out=w0)
+    w0 += t2
+    w0 -= np.multiply(0.5, t3, out=tmp)
+    np.multiply(2.5, t2, out=w1)
+    np.subtract(1, w1, out=w1)
+    w1 += np.multiply(1.5, t3, out=tmp)
+    np.multiply(0.5, t, out=w2)
+    w2 += np.multiply(2, t2, out=tmp)
+    w2 -= np.multiply(1.5, t3, out=tmp)
+    np.multiply(-0.5, t2, out=w3)
+    w3 += np.multiply(0.5, t3, out=tmp)
+    return out
+
+class InterpolationPlan():
+    """ This class encodes the interpolation of fields from a 2D grid to the 'upstream' unstructured mesh
+    defined by the displacements alpha_x, alpha_y (see :func:`upstream_interp`).
+
+    The indices of the upstream points and the interpolation weights only depend on the
+    displacements. They are computed the first time a method is used and are then reused for
+    every field interpolated with this method.
+
+    With several workers, the output grid is split into bands of rows which are processed by
+    a pool of threads. Each band only computes its own upstream points and gathers them from
+    the full (periodic) field, thus the result is identical to the serial one.
+
+    The displacements can have a leading ensemble axis (Ne, Nx, Ny): each member is then 
+    interpolated with its own displacements, all the members being gathered at once.
+
+    The 'damped_bicubic' method blends the linear and the bicubic interpolations,
+    kappa * linear + (1 - kappa) * bicubic, in a single gather of the bicubic stencil: the linear 
+    estimate is taken from the four central points of the 4x4 stencil. All the methods are periodic
+    of periods Nx and Ny.
+
+    :param alpha_x: a two dimensional field of displacement along the first dimension (or a stack of Ne fields)
+    :type alpha_x: ndarray
+    :param alpha_y: a two dimensional field of displacement along the second dimension (or a stack of Ne fields)
+    :type alpha_y: ndarray
+    :param method: default method used for the interpolation: 'nearest', 'linear', 'diffusive', 'bicubic' or 'damped_bicubic'. Defaults to 'linear'
+    :type method: string, optional
+    :param verbose: a scalar between 0 and 2. The higher the number, the more prints. Defaults to 0
+    :type verbose: int, optional
+    :param backend: 'numpy' or 'numba'. With 'numba', the 'linear', 'diffusive', 'bicubic' and 'damped_bicubic' methods use the compiled kernels of :mod:`jit_kernels` \
+        (if Numba is not installed, the numpy implementation is used). Defaults to 'numpy'
+    :type backend: string, optional
+    :param workers: Number of threads of the numpy implementation, defaults to 1
+    :type workers: int, optional
+    :param workspace: If given, the 'linear' and 'bicubic' stencils and the temporary arrays of the interpolations \
+        are written in its buffers instead of new arrays (see :func:`workspace.get_workspace`). The stencils of the \
+        plan are then overwritten by the next plan using the same workspace: a single plan must be used at a time. Defaults to None
+    :type workspace: :class:`Workspace` object, optional
+    :param kappa: Relaxation coefficient of the 'damped_bicubic' method, of the shape of alpha_x \
+        (see :func:`advection_step_3P.damping_coefficient`), defaults to None
+    :type kappa: ndarray, optional
+    :param halo: Number of rows the interpolated fields have in addition on both sides of the rows of the displacements, \
+        e.g. the halos of a slab of a distributed grid (see :meth:`SlabDecomposition.halo`). The departure points must lie \
+        within them, the fields being periodic along the second dimension only. Not available with 'diffusive', defaults to 0
+    :type halo: int, optional
+    """
+    methods = ['nearest', 'linear', 'diffusive', 'bicubic', 'damped_bicubic']
+
+    def __init__(self, alpha_x, alpha_y, method='linear', verbose=0, backend='numpy', workers=1, workspace=None,
+                 kappa=None, halo=0):
+        """ Constructor method
+        """
+        self.alpha_x = alpha_x
+        self.alpha_y = alpha_y
+        self.method = method
+        self.verbose = verbose
+        self.jit = use_jit(backend)
+        self.shape = alpha_x.shape[-2:]
+        # shape of the interpolated fields
+        self.halo = halo
+        self.field_shape = (self.shape[0] + 2*halo, self.shape[1])
+        # the displacements of the members, (Ne, Nx, Ny) with Ne = 1 without ensemble axis
+        self._alpha_x = alpha_x.reshape((-1,) + self.shape)
+        self._alpha_y = alpha_y.reshape((-1,) + self.shape)
+        self.members = self._alpha_x.shape[0]
+        # floating point type of the positions and weights
+        self.dtype = np.result_type(alpha_x.dtype, alpha_y.dtype, np.float32)
+        self.workers = max(1, min(workers, self.shape[0]))
+        bounds = np.linspace(0, self.shape[0], self.workers + 1).astype(int)
+        self.bands = list(zip(bounds[:-1], bounds[1:]))
+        self._stencils = {}
+        self.workspace = workspace
+        self.kappa = kappa
+        self._kappa = kappa.reshape((-1,) + self.shape) if kappa is not None else None
+
+    def stencil(self, method, band=0):
+        """ Indices (flat, in the (Ne, Nx, Ny) grid of the members) and weights of the points used by a method for a band of rows, computed at the first call.
+
+        :param method: method used for the interpolation
+        :type method: string
+        :param band: index of the band of rows, defaults to 0
+        :type band: int, optional
+        :raises "Unknown method for interpolation": Invalid string as a method for interpolation
+        :return: The flat indices and the weights
+        :rtype: tuple
+        """
+        if (method, band) not in self._stencils:
+            if method not in self.methods:
+                raise Exception("Unknown method for interpolation: " + method)
+            self._stencils[(method, band)] = getattr(self, '_stencil_' + method)(*self.bands[band])
+        return self._stencils[(method, band)]
+
+    def _grid(self, r0, r1):
+        # Open grids of the rows r0 to r1, as indices of the rows of the fields
+        # (no full size index array is created)
+        Nx, Ny = self.shape
+        r0, r1 = r0 + self.halo, r1 + self.halo
+        if self.workspace is not None:
+            return self.workspace.indices(r0, r1, self.dtype)[:, None], self.workspace.indices(0, Ny, self.dtype)[None, :]
+        return np.arange(r0, r1, dtype=self.dtype)[:, None], np.arange(Ny, dtype=self.dtype)[None, :]
+
+    def _empty(self, name, r0, r1, dtype=None, dim=None):
+        # Array of the points of the rows r0 to r1 (of a field of dimension dim), 
+        # taken from the workspace if any
+        shape = ((dim,) if dim is not None else ()) + (self.members, r1 - r0, self.shape[1])
+        dtype = dtype if dtype is not None else self.dtype
+        if self.workspace is None:
+            return np.empty(shape, dtype=dtype)
+        return self.workspace.buffer('interp_{}_{}'.format(name, r0), shape, dtype)
+
+    def _offset(self):
+        # Flat index of the first point of each member
+        Nx, Ny = self.field_shape
+        return (np.arange(self.members) * (Nx * Ny))[:, None, None]
+
+    def _stencil_nearest(self, r0, r1):
+        Nx, Ny = self.field_shape
+        [X, Y] = self._grid(r0, r1)
+
+        # Fetch the closest neighbor (periodic boundary conditions)
+        Xn = np.mod(np.round(X - self._alpha_x[:, r0:r1]).astype(int), Nx)
+        Yn = np.mod(np.round(Y - self._alpha_y[:, r0:r1]).astype(int), Ny)
+        return Xn * Ny + Yn + self._offset()
+
+    def _stencil_linear(self, r0, r1):
+        Nx, Ny = self.field_shape
+        [X, Y] = self._grid(r0, r1)
+        empty = lambda name, dtype=None: self._empty('linear_' + name, r0, r1, dtype)
+
+        Xi = np.mod(np.subtract(X, self._alpha_x[:, r0:r1], out=empty('Xi')), Nx, out=empty('Xi'))
+        Yi = np.mod(np.subtract(Y, self._alpha_y[:, r0:r1], out=empty('Yi')), Ny, out=empty('Yi'))
+
+        Xc = np.ceil(Xi, out=empty('Xc'))
+        Yc = np.ceil(Yi, out=empty('Yc'))
+
+        Xt = empty('Xt', int)
+        Yt = empty('Yt', int)
+        np.copyto(Xt, Xc, casting='unsafe')
+        np.copyto(Yt, Yc, casting='unsafe')
+
+        # fractional parts: Xc = ceil(Xi) - Xi
+        Xc -= Xi
+        Yc -= Yi
+
+        # Xt - 1 and Yt - 1 can be equal to -1, Xt and Yt to Nx and Ny (periodic indices)
+        Xm = np.mod(np.subtract(Xt, 1, out=empty('Xm', int)), Nx, out=empty('Xm', int))
+        Xm *= Ny
+        Xm += self._offset()
+        Ym = np.mod(np.subtract(Yt, 1, out=empty('Ym', int)), Ny, out=empty('Ym', int))
+        np.mod(Xt, Nx, out=Xt)
+        np.mod(Yt, Ny, out=Yt)
+        Xt *= Ny
+        Xt += self._offset()
+
+        ind = [np.add(Xm, Ym, out=empty('i0', int)), np.add(Xm, Yt, out=empty('i1', int)),
+               np.add(Xt, Yt, out=empty('i2', int)), np.add(Xt, Ym, out=empty('i3', int))]
+        # Xi and Yi are not needed anymore: they hold 1 - Xc and 1 - Yc
+        Xd = np.subtract(1, Xc, out=Xi)
+        Yd = np.subtract(1, Yc, out=Yi)
+        weights = [np.multiply(Xc, Yc, out=empty('w0')), np.multiply(Xc, Yd, out=empty('w1')),
+                   np.multiply(Xd, Yd, out=empty('w2')), np.multiply(Xd, Yc, out=empty('w3'))]
+        return ind, weights
+
+    def _stencil_diffusive(self, r0, r1):
+        Nx, Ny = self.shape
+
+        # The gathered field is shifted by one row: the row preceding 
+        # the band is also needed.
+        rows = np.mod(np.arange(r0 - 1, r1), Nx)
+        X = rows.astype(self.dtype)[:, None]
+        Y = np.arange(Ny, dtype=self.dtype)[None, :]
+
+        Xt = np.ceil(X - self._alpha_x[:, rows]).astype(int)
+        Yt = np.ceil(Y - self._alpha_y[:, rows]).astype(int)
+        ind = np.mod(Xt, Nx) * Ny + np.mod(Yt, Ny) + self._offset()
+
+        [X, Y] = self._grid(r0, r1)
+
+        Xi = X - self._alpha_x[:, r0:r1]
+        Yi = Y - self._alpha_y[:, r0:r1]
+
+        Xc = np.ceil(Xi) - Xi
+        Yc = np.ceil(Yi) - Yi
+
+        weights = [Xc * Yc, Xc * (1 - Yc), (1 - Xc) * (1 - Yc), (1 - Xc) * Yc]
+        return ind, weights
+
+    def _stencil_bicubic(self, r0, r1):
+        # For a given point, bi-cubic interpolation fits the value of the
+        # four surrounding points as well as the slope at each of these
+        # points. The slope is evaluated using centered finite differences.
+        # We can reduce this operation to a weight for each of the sixteen
+        # surrounding points: the tensor product of the 1D Catmull-Rom
+        # weights.
+        Nx, Ny = self.field_shape
+        empty = lambda name, dtype=None: self._empty('bicubic_' + name, r0, r1, dtype)
+
+        [X, Y] = self._grid(r0, r1)
+
+        Xb = np.subtract(X, self._alpha_x[:, r0:r1], out=empty('Xb'))
+        Yb = np.subtract(Y, self._alpha_y[:, r0:r1], out=empty('Yb'))
+
+        Xf = np.floor(Xb, out=empty('Xf'))
+        Yf = np.floor(Yb, out=empty('Yf'))
+
+        Xb -= Xf
+        Yb -= Yf
+
+        # Weights along each direction
+        work = [empty('t2'), empty('t3'), empty('tmp')]
+        Wx = catmull_rom_weights(Xb, [empty('Wx{}'.format(i)) for i in range(4)], work)
+        Wy = catmull_rom_weights(Yb, [empty('Wy{}'.format(j)) for j in range(4)], work)
+
+        # Flat indices of the stencil rows and columns (periodic)
+        Xi = empty('Xi', int)
+        Yi = empty('Yi', int)
+        np.copyto(Xi, Xf, casting='unsafe')
+        np.copyto(Yi, Yf, casting='unsafe')
+        Xs = [np.mod(np.add(Xi, i - 1, out=empty('Xs{}'.format(i), int)), Nx, out=empty('Xs{}'.format(i), int)) for i in range(4)]
+        for i in range(4):
+            Xs[i] *= Ny
+            Xs[i] += self._offset()
+        Ys = [np.mod(np.add(Yi, j - 1, out=empty('Ys{}'.format(j), int)), Ny, out=empty('Ys{}'.format(j), int)) for j in range(4)]
+        # the fractional positions are kept for the linear weights of 'damped_bicubic'
+        return Xs, Ys, Wx, Wy, Xb, Yb
+
+    def _stencil_damped_bicubic(self, r0, r1):
+        # The bicubic stencil, shared with the 'bicubic' method, and the
+        # weights of the linear interpolation between its central points 
+        # 1 and 2 along each direction.
+        empty = lambda name: self._empty('damped_' + name, r0, r1)
+        Xs, Ys, Wx, Wy, Xb, Yb = self.stencil('bicubic', self.bands.index((r0, r1)))
+        Lx = [np.subtract(1, Xb, out=empty('Lx')), Xb]
+        Ly = [np.subtract(1, Yb, out=empty('Ly')), Yb]
+        return Xs, Ys, Wx, Wy, Lx, Ly
+
+    def _interpolate(self, F_flat, method, band, F_int):
+        # Interpolation of the rows of a band, written in F_int
+        r0, r1 = self.bands[band]
+        out = F_int[:, :, r0:r1]
+        stencil = self.stencil(method, band)
+
+        if method=='nearest':
+            out[...] = np.take(F_flat, stencil, axis=1)
+
+        elif method=='linear':
+            ind, weights = stencil
+            F_pt = self._empty('F_pt', r0, r1, F_flat.dtype, len(F_flat))
+            np.multiply(weights[0], np.take(F_flat, ind[0], axis=1, out=F_pt, mode='clip'), out=out)
+            for k in range(1, 4):
+                np.take(F_flat, ind[k], axis=1, out=F_pt, mode='clip')
+                F_pt *= weights[k]
+                out += F_pt
+
+        elif method=='diffusive':
+            ind, [W00, W01, W11, W10] = stencil
+            Ft = np.take(F_flat, ind, axis=1)
+
+            out[...] = W00 * np.roll(Ft[:, :, :-1], 1, -1) \
+                       + W01 * Ft[:, :, :-1] \
+                       + W11 * Ft[:, :, 1:] \
+                       + W10 * np.roll(Ft[:, :, 1:], 1, -1)
+
+        elif method=='bicubic':
+            # Only the 4x4 stencil of each departure point is gathered, one
+            # point at a time, so that no full size copy of F is needed.
+            Xs, Ys, Wx, Wy, _, _ = stencil
+            out[...] = 0
+            ind = self._empty('ind', r0, r1, int)
+            W = self._empty('W', r0, r1, Wx[0].dtype)
+            F_pt = self._empty('F_pt', r0, r1, F_flat.dtype, len(F_flat))
+            for i in range(4):
+                for j in range(4):
+                    np.add(Xs[i], Ys[j], out=ind)
+                    np.take(F_flat, ind, axis=1, out=F_pt, mode='clip')
+                    np.multiply(Wx[i], Wy[j], out=W)
+                    F_pt *= W
+                    out += F_pt
+
+        elif method=='damped_bicubic':
+            # Same gather as 'bicubic': the four central points are also
+            # accumulated with the linear weights, then both estimates are
+            # blended as bicubic + kappa * (linear - bicubic).
+            Xs, Ys, Wx, Wy, Lx, Ly = stencil
+            out[...] = 0
+            ind = self._empty('ind', r0, r1, int)
+            W = self._empty('W', r0, r1, Wx[0].dtype)
+            F_pt = self._empty('F_pt', r0, r1, F_flat.dtype, len(F_flat))
+            F_lin = self._empty('F_lin', r0, r1, out.dtype, len(F_flat))
+            F_w = self._empty('F_w', r0, r1, out.dtype, len(F_flat))
+            F_lin[...] = 0
+            for i in range(4):
+                for j in range(4):
+                    np.add(Xs[i], Ys[j], out=ind)
+                    np.take(F_flat, ind, axis=1, out=F_pt, mode='clip')
+                    if i in (1, 2) and j in (1, 2):
+                        np.multiply(Lx[i-1], Ly[j-1], out=W)
+                        F_lin += np.multiply(F_pt, W, out=F_w)
+                    np.multiply(Wx[i], Wy[j], out=W)
+                    F_pt *= W
+                    out += F_pt
+            F_lin -= out
+            F_lin *= self._kappa[:, r0:r1]
+            out += F_lin
+
+    def __call__(self, F, method=None, out=None):
+        """ Interpolates a field on the upstream mesh
+
+        :param F: 2D-Field to be advected. \
+            A vectorial field can be advected (the X and Y dimension should come second and third). \
+            With an ensemble plan, each field has the shape (Ne, Nx, Ny) and a vectorial field the shape (dim, Ne, Nx, Ny)
+        :type F: ndarray
+        :param method: method used for the interpolation, defaults to None (method of the plan)
+        :type method: string, optional
+        :param out: C-contiguous array of the shape and type of the result where it is written, defaults to None (new array)
+        :type out: ndarray, optional
+        :raises "Invalid output array": out has not the shape or the type of the result, or is not contiguous
+        :raises "The 'damped_bicubic' method needs the relaxation coefficient kappa": 'damped_bicubic' used by a plan built without kappa
+        :raises "The 'diffusive' method cannot be used with halos": 'diffusive' used by a plan with halos
+        :return: F_int: Advected field.
+        :rtype: ndarray
+        """
+        method = method if method is not None else self.method
+        if method == 'damped_bicubic' and self._kappa is None:
+            raise Exception("The 'damped_bicubic' method needs the relaxation coefficient kappa")
+        if method == 'diffusive' and self.halo:
+            raise Exception("The 'diffusive' method cannot be used with halos")
+        print("         upstream_interp called with method: ", method) if self.verbose > 2 else None
+
+        with span('upstream_interp', 'interpolation', method=method, members=self.members):
+            return self._call(F, method, out)
+
+    def _call(self, F, method, out):
+        # a vectorial field has one more leading axis than the displacements
+        F = F.reshape((-1, self.members) + self.field_shape)
+
+        [dim,Ne] = F.shape[:2]
+        [Nx,Ny] = self.shape
+        dtype = np.result_type(F.dtype, self.dtype)
+        if out is None:
+            F_int = np.empty((dim,Ne,Nx,Ny), dtype=dtype)
+        else:
+            shape = ((dim,) if dim > 1 else ()) + self.alpha_x.shape
+            if out.shape != shape or out.dtype != dtype or not out.flags.c_contiguous:
+                raise Exception("Invalid output array for the interpolation: {} {} expected".format(shape, dtype))
+            F_int = out.reshape((dim,Ne,Nx,Ny))
+
+        if self.jit and method in interp_kernels:
+            # the compiled kernels compute the indices and weights on the fly,
+            # one member at a time
+            for m in range(Ne):
+                target = F_int[:, m]
+                F_m = target if target.flags.c_contiguous else np.empty((dim,Nx,Ny), dtype=dtype)
+                kappa = (np.ascontiguousarray(self._kappa[m]),) if method == 'damped_bicubic' else ()
+                interp_kernels[method](np.ascontiguousarray(self._alpha_x[m]),
+                                       np.ascontiguousarray(self._alpha_y[m]),
+                                       np.ascontiguousarray(F[:, m]), F_m, *kappa)
+                if F_m is not target:
+                    target[...] = F_m
+        else:
+            F_flat = F.reshape(dim, -1)
+            if len(self.bands) == 1:
+                self._interpolate(F_flat, method, 0, F_int)
+            else:
+                # the bands are written in disjoint parts of F_int
+                list(thread_pool(self.workers).map(lambda band: self._interpolate(F_flat, method, band, F_int),
+                                                   range(len(self.bands))))
+
+        if out is not None:
+            return out
+        if dim==1:
+            F_int = F_int[0]
+        return F_int.reshape(F_int.shape[:-3] + self.alpha_x.shape)
+
+def upstream_interp(alpha_x, alpha_y, F, method='linear', verbose=0, ho=0.15, backend='numpy', workers=1, **kwargs):
     """
     upstream_interp interpolates a multidimensionnal field F from a 2D grid to an 'upstream' unstructured mesh defined by the displacements alpha_x, alpha_y. \
     If F were a continuous field, we would have: F_int(x,y) = F(x-alpha, y-alpha)
-        
+
+    When several fields or methods are used with the same displacements, an :class:`InterpolationPlan` should be built once and reused.
+
     :param alpha_x: a two dimensional field of displacement along the first dimension
     :type alpha_x: ndarray
     :param alpha_y: a two dimensional field of displacement along the second dimension
@@ -12,180 +442,18 @@ def upstream_interp(alpha_x, alpha_y, F, method='linear', verbose=0, ho=0.15, **
     :param F: 2D-Field to be advected. \
         A vectorial field can be advected (the X and Y dimension should come second and third)
     :type F: ndarray
-    :param method: method used for the interpolation: 'nearest', 'linear', or 'bicubic'. Defaults to 'linear'
+    :param method: method used for the interpolation: 'nearest', 'linear', 'diffusive' or 'bicubic'. Defaults to 'linear'
     :type method: string, optional
     :param verbose: a scalar between 0 and 2. The higher the number, the more prints. Defaults to 0
     :type verbose: int, optional
     :param ho: Distance around grid points where additional diffusion is added with the 'damping' method. Defaults to 0.15.
     :type ho: int, optional
+    :param backend: 'numpy' or 'numba', see :class:`InterpolationPlan`. Defaults to 'numpy'
+    :type backend: string, optional
+    :param workers: Number of threads of the numpy implementation, see :class:`InterpolationPlan`. Defaults to 1
+    :type workers: int, optional
     :raises "Unknown method for interpolation": Invalid string as a method for interpolation
-    :return: F_int: Advected field. 
+    :return: F_int: Advected field.
     :rtype: ndarray
     """
-
-
-    print("         upstream_interp called with method: ", method) if verbose > 2 else None
-
-    if len(F.shape)==2:
-        F = np.array([F])
-        
-    [dim,Nx,Ny] = F.shape
-    F_int = np.zeros((dim,Nx,Ny))
-    if method=='nearest':
-         # Coordinates of the points of the upstream mesh
-         [x_grid, y_grid] = np.mgrid[0:Nx, 0:Ny]
-         x_grid = x_grid - alpha_x
-         y_grid = y_grid - alpha_y
-         
-         # Apply periodic boundary coniditions. Note that nothing is done
-         # for x,y<0 as the indices are already periodic in Python. 
-         x_grid[np.where(x_grid > Nx-1)] -= (Nx-1)
-         y_grid[np.where(y_grid > Ny-1)] -= (Ny-1)
-         
-         # Fetch the closest neighbor
-         F_int[:,:,:] = F[np.round(x_grid), np.round(y_grid),:] ##### seems to generate bugs
-         
-    elif method=='linear':
-        [X, Y] = np.mgrid[0:Nx,0:Ny] 
-        
-        Xi = np.mod(X - alpha_x, Nx - 1)
-        Yi = np.mod(Y - alpha_y, Ny - 1)
-        
-        Xt = np.ceil(Xi).astype(int)
-        Yt = np.ceil(Yi).astype(int)
-        
-        Xc = Xt - Xi
-        Yc = Yt - Yi
-        
-        F_int[:, X, Y] = Xc * Yc * F[:, Xt - 1, Yt -1] \
-                   + Xc * (1 - Yc) * F[:, Xt - 1, Yt] \
-                   + (1 - Xc) * (1 - Yc) * F[:, Xt, Yt] \
-                   + (1 - Xc) * Yc * F[:, Xt, Yt - 1] 
-                   
-                   
-    elif method=='diffusive':
-        [X, Y] = np.mgrid[0:Nx,0:Ny] 
-        
-        Xi = X - alpha_x
-        Yi = Y - alpha_y
-        
-        Xt = np.ceil(Xi).astype(int)
-        Yt = np.ceil(Yi).astype(int)
-        
-        Xc = Xt - Xi
-        Yc = Yt - Yi
-        
-        Xt = np.mod(Xt, Nx)
-        Yt = np.mod(Yt, Ny)
-        
-        Ft = F[:, Xt, Yt]
-        
-        F_int = Xc * Yc * np.roll(Ft, (1, 1), (1,2)) \
-                   + Xc * (1 - Yc) * np.roll(Ft, 1, 1) \
-                   + (1 - Xc) * (1 - Yc) * Ft \
-                   + (1 - Xc) * Yc * np.roll(Ft, 1, 2) 
-        
-
-    elif method=='bicubic':
-         # For a given point, bi-cubic interpolation fits the value of the 
-        # four surrounding points as well as the slope at each of these 
-        # points. The slope is evaluated using centered finite differences.
-        # We can reduce this operation to a weight for each of the sixteen
-        # surrounding points. We compute these weights for each grid cell.
-        # Each of the 16 is thus stored in an array..
-        
-        #-----------------------------------------------------------------
-        [X, Y] = np.mgrid[0:Nx,0:Ny] 
-        
-        Xi = X - alpha_x
-        Yi = Y - alpha_y
-        
-        Xf = np.mod( np.floor(Xi).astype(int), Nx)
-        Yf = np.mod( np.floor(Yi).astype(int), Ny)
-        
-        Xb = np.abs(Xi - np.floor(Xi))
-        Yb = np.abs(Yi - np.floor(Yi))
-        
-        
-        
-        # We define 'rolled' arrays that appears multiple times 
-        F00 = np.roll(F, (1,1), (1,2))
-        F01 = np.roll(F, (1,0), (1,2))
-        F02 = np.roll(F, (1,-1), (1,2))
-        F03 = np.roll(F, (1,-2), (1,2))
-        F10 = np.roll(F, (0,1), (1,2))
-        F11 = np.roll(F, (0,0), (1,2))
-        F12 = np.roll(F, (0,-1), (1,2))
-        F13 = np.roll(F, (0,-2), (1,2))
-        F20 = np.roll(F, (-1,1), (1,2))
-        F21 = np.roll(F, (-1,0), (1,2))
-        F22 = np.roll(F, (-1,-1), (1,2))
-        F23 = np.roll(F, (-1,-2), (1,2))
-        F30 = np.roll(F, (-2,1), (1,2))
-        F31 = np.roll(F, (-2,0), (1,2))
-        F32 = np.roll(F, (-2,-1), (1,2))
-        F33 = np.roll(F, (-2,-2), (1,2))
-        
-        # Computation of the weights -------------------------------------
-        A00 = F11
-        
-        A01 = -0.5 * F10 + 0.5 * F12
-        
-        A02 = F10 - 2.5 * F11 + 2 * F12 -  0.5 * F13
-            
-        A03 = -.5 * F10 + 1.5 * F11 - 1.5 * F12 + 0.5 * F13
-            
-        A10 = -.5 * F01 + 0.5 * F21
-        
-        A11 = 0.25 * F00 - 0.25 * F02 - 0.25 * F20 + 0.25 * F22
-            
-        A12 = -.5 * F00 + 1.25 * F01 - F02 +  0.25 * F03 + 0.5 * F20 - 1.25  \
-            * F21 + F22 - 0.25 * F23
-                    
-        A13 = 0.25 * F00 - 0.75 * F01 + 0.75 * F02 - 0.25 * F03 - 0.25 * F20 \
-            + 0.75 * F21 - 0.75 * F22 + 0.25 * F23
-                
-        A20 = F01 - 2.5 * F11 + 2 * F21 -  0.5 * F31
-            
-        A21 = -.5 * F00 + 0.5 * F02 + 1.25 * F10 - 1.25 * F12 - F20 + F22 + \
-            0.25 * F30 - 0.25 * F32
-                    
-        A22 = F00 - 2.5 * F01 + 2 * F02 - 0.5 * F03 - 2.5 * F10 +  6.25 * \
-            F11 - 5 * F12 + 1.25 * F13 + 2 * F20  - 5 * F21 + 4 * F22 - \
-            F23 - 0.5 * F30 + 1.25 * F31  - F32 + 0.25 * F33
-                            
-        A23 = -.5 * F00 + 1.5 * F01 - 1.5 * F02 +  0.5 * F03 + 1.25 * F10 - \
-            3.75 * F11 + 3.75 * F12 -  1.25 * F13 - F20 + 3 * F21 - 3 * F22 \
-                +  F23 + 0.25 * F30 - 0.75 * F31 + 0.75 * F32 - 0.25 * F33
-                    
-        A30 = -.5 * F01 + 1.5 * F11 - 1.5 * F21 + 0.5 * F31
-            
-        A31 = 0.25 * F00 - 0.25 * F02 - 0.75 * F10 + 0.75 * F12 + 0.75 * F20 \
-            - 0.75 * F22 - 0.25 * F30 + 0.25 * F32;
-        
-        A32 = -.5 * F00 + 1.25 * F01 - F02 + 0.25 * F03 + 1.5 * F10 - 3.75 *\
-            F11 + 3 * F12 - 0.75 * F13 - 1.5 * F20 + 3.75 * F21 - 3 * F22 +\
-            0.75 * F23 + 0.5 * F30 - 1.25 * F31 + F32 - 0.25 * F33
-		
-        A33 = 0.25 * F00 - 0.75 * F01 + 0.75 * F02 - 0.25 * F03 - 0.75 * F10 \
-            + 2.25 * F11 - 2.25 * F12 + 0.75 * F13 + 0.75 * F20 - 2.25 * F21 +\
-            2.25 * F22 - 0.75 * F23 - 0.25 * F30 + 0.75 * F31 - 0.75 * F32 +\
-            0.25 * F33
-    
-        
-        #Update of F
-        F_int = (A00[:,Xf, Yf] + A01[:,Xf, Yf] * Yb + A02[:,Xf, Yf] * Yb**2 + \
-                 A03[:,Xf, Yf] * Yb**3) + \
-                (A10[:,Xf, Yf] + A11[:,Xf, Yf] * Yb + A12[:,Xf, Yf] * Yb**2 + \
-                 A13[:,Xf, Yf] * Yb**3) * Xb + \
-                (A20[:,Xf, Yf] + A21[:,Xf, Yf] * Yb + A22[:,Xf, Yf] * Yb**2 + \
-                 A23[:,Xf, Yf] * Yb**3) * Xb**2 + \
-                (A30[:,Xf, Yf] + A31[:,Xf, Yf] * Yb + A32[:,Xf, Yf] * Yb**2 + \
-                 A33[:,Xf, Yf] * Yb**3) * Xb**3  
-    else:
-        raise Exception("Unknown method for interpolation: " + method)
-    if dim==1:
-        F_int = F_int[0,:,:]
-    
-    return F_int
-
+    return InterpolationPlan(alpha_x, alpha_y, method, verbose, backend, workers)(F)
@@ -0,0 +1,92 @@
+import threading
+
+import numpy as np
+
+# The workspaces are kept per thread: two simulations running in different
+# threads never share their scratch buffers.
+_local = threading.local()
+
+class Workspace():
+    """ This class encodes the scratch memory of the computations on a grid: named buffers, allocated
+    at the first request and returned again by the next requests with the same name, shape and type,
+    and the integer index grids of the grid. Reusing them in the time loop avoids allocating (and
+    page faulting) large temporary arrays at each step.
+
+    A buffer is only valid until the next request of the same name: it must not be kept nor
+    returned to the caller of the function using it.
+
+    :param shape: Shape (Nx, Ny) of the grid
+    :type shape: tuple of int
+    """
+    def __init__(self, shape):
+        """ Constructor method
+        """
+        self.shape = tuple(shape)
+        self._buffers = {}
+        self._indices = {}
+
+    def buffer(self, name, shape, dtype=np.float64):
+        """ Scratch array of a given name, shape and type (its values are undefined)
+
+        :param name: Name of the buffer
+        :type name: str
+        :param shape: Shape of the buffer
+        :type shape: tuple of int
+        :param dtype: Type of the buffer, defaults to np.float64
+        :type dtype: numpy dtype, optional
+        :rtype: ndarray
+        """
+        key = (name, tuple(shape), np.dtype(dtype))
+        if key not in self._buffers:
+            self._buffers[key] = np.empty(shape, dtype=dtype)
+        return self._buffers[key]
+
+    def indices(self, start, stop, dtype=np.float64):
+        """ Read-only array of the indices start to stop - 1
+
+        :param start: First index
+        :type start: int
+        :param stop: Last index plus one
+        :type stop: int
+        :param dtype: Type of the indices (the positions of the interpolations are floating point), defaults to np.float64
+        :type dtype: numpy dtype, optional
+        :rtype: ndarray
+        """
+        key = (start, stop, np.dtype(dtype))
+        if key not in self._indices:
+            indices = np.arange(start, stop, dtype=dtype)
+            indices.flags.writeable = False
+            self._indices[key] = indices
+        return self._indices[key]
+
+    @property
+    def nbytes(self):
+        """ Memory used by the buffers, in bytes
+        """
+        return sum(buffer.nbytes for buffer in self._buffers.values())
+
+    def clear(self):
+        """ Frees the buffers
+        """
+        self._buffers.clear()
+        self._indices.clear()
+
+def get_workspace(shape):
+    """ Workspace of a grid shape for the calling thread
+
+    :param shape: Shape (Nx, Ny) of the grid
+    :type shape: tuple of int
+    :rtype: :class:`Workspace` object
+    """
+    workspaces = getattr(_local, 'workspaces', None)
+    if workspaces is None:
+        workspaces = _local.workspaces = {}
+    shape = tuple(shape)
+    if shape not in workspaces:
+        workspaces[shape] = Workspace(shape)
+    return workspaces[shape]
+
+def clear_workspaces():
+    """ Frees the workspaces of the calling thread
+    """
+    _local.workspaces = {}
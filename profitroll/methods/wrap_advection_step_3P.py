@@ -1,7 +1,7 @@
 from .advection_step_3P import advection_step_3P
-from ..core.state import State
 
-def wrap_advection_step_3P(history, grid, params, alpha_method, order_alpha, F_method, verbose=0, **kwargs):
+def wrap_advection_step_3P(history, grid, params, alpha_method, order_alpha, F_method, verbose=0, interp_backend='numpy', interp_workers=1,
+                           alpha_tol=None, alpha_solver='fixed_point', alpha_stats=None, decomposition=None, **kwargs):
     """Wrap the :class:`advection_step_3P` method to fit the architecture
 
     :param history: Current history of state
@@ -16,8 +16,20 @@ def wrap_advection_step_3P(history, grid, params, alpha_method, order_alpha, F_m
     :type order_alpha: int
     :param F_method: see :class:`advection_step_3P`
     :type F_method: str
+    :param interp_backend: 'numpy' or 'numba' (compiled interpolation kernels, if Numba is installed), defaults to 'numpy'
+    :type interp_backend: str, optional
+    :param interp_workers: Number of threads of the numpy interpolation (see :class:`InterpolationPlan`), defaults to 1
+    :type interp_workers: int, optional
+    :param alpha_tol: Tolerance of the estimation of the displacement, see :class:`advection_step_3P`, defaults to None (order_alpha iterations)
+    :type alpha_tol: float, optional
+    :param alpha_solver: 'fixed_point' or 'newton', see :class:`advection_step_3P`, defaults to 'fixed_point'
+    :type alpha_solver: str, optional
+    :param alpha_stats: Dictionary where the numbers of iterations of each step are appended (stats of :class:`advection_step_3P`), defaults to None
+    :type alpha_stats: dictionary, optional
     :param verbose: verbose, defaults to 0
     :type verbose: int, optional
+    :param decomposition: Decomposition of the grid of a distributed run (see :class:`Simulation`), defaults to None
+    :type decomposition: :class:`SlabDecomposition` object, optional
     """
     assert history.size > 1
     pre_state = history.state_list[-2]
@@ -25,7 +37,7 @@ def wrap_advection_step_3P(history, grid, params, alpha_method, order_alpha, F_m
 
     dt = cur_state.t - pre_state.t # constant step
 
-    new_state = State.copy(cur_state)
+    new_state = history.new_state(cur_state)
     new_state.t += dt              # constant step
     
     a_ut, a_vt, theta_new = advection_step_3P(pre_state.vrs['alpha_ut'],
@@ -39,7 +51,13 @@ def wrap_advection_step_3P(history, grid, params, alpha_method, order_alpha, F_m
                                               alpha_method,
                                               order_alpha,
                                               F_method,
-                                              verbose)
+                                              verbose,
+                                              interp_backend,
+                                              interp_workers,
+                                              alpha_tol,
+                                              alpha_solver,
+                                              alpha_stats,
+                                              decomposition=decomposition)
     print("      ut vt done") if verbose > 2 else None
     
     cur_state.vrs['alpha_ut'] = a_ut
@@ -48,3 +66,6 @@ def wrap_advection_step_3P(history, grid, params, alpha_method, order_alpha, F_m
     new_state.vrs['theta_t'] = theta_new
     
     history.append(new_state)
+
+# variables read or written by the method (see the load_variables argument of Simulation)
+wrap_advection_step_3P.variables = ['theta_t', 'alpha_ut', 'alpha_vt', 'ut', 'vt']
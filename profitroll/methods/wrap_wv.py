@@ -1,9 +1,10 @@
 from .advection_step_3P import advection_step_3P
-from .spectral import vertwind
+from .spectral import vertwind, state_spectrum
 from ..core.state import State #, variables
 import numpy as np
 
-def wrap_wv(history, grid, params, alpha_method, order_alpha, F_method, verbose=0, **kwargs):
+def wrap_wv(history, grid, params, alpha_method, order_alpha, F_method, verbose=0, fft_backend=None, interp_backend='numpy', interp_workers=1,
+            alpha_tol=None, alpha_solver='fixed_point', alpha_stats=None, decomposition=None, **kwargs):
     """Wrap the water vapor method to fit the architecture.
     
     :param history: Current history of state
@@ -18,8 +19,22 @@ def wrap_wv(history, grid, params, alpha_method, order_alpha, F_method, verbose=
     :type order_alpha: int
     :param F_method: see :class:`advection_step_3P`
     :type F_method: str
+    :param interp_backend: 'numpy' or 'numba' (compiled interpolation kernels, if Numba is installed), defaults to 'numpy'
+    :type interp_backend: str, optional
+    :param interp_workers: Number of threads of the numpy interpolation (see :class:`InterpolationPlan`), defaults to 1
+    :type interp_workers: int, optional
+    :param alpha_tol: Tolerance of the estimation of the displacement, see :class:`advection_step_3P`, defaults to None (order_alpha iterations)
+    :type alpha_tol: float, optional
+    :param alpha_solver: 'fixed_point' or 'newton', see :class:`advection_step_3P`, defaults to 'fixed_point'
+    :type alpha_solver: str, optional
+    :param alpha_stats: Dictionary where the numbers of iterations of each step are appended (stats of :class:`advection_step_3P`), defaults to None
+    :type alpha_stats: dictionary, optional
     :param verbose: verbose, defaults to 0
     :type verbose: int, optional
+    :param decomposition: Decomposition of the grid of a distributed run (see :class:`Simulation`), defaults to None
+    :type decomposition: :class:`SlabDecomposition` object, optional
+    :param fft_backend: FFT backend of the simulation, defaults to None (numpy)
+    :type fft_backend: backend object, optional
     """
     assert history.size > 2
     pre_state = history.state_list[-3]
@@ -40,7 +55,13 @@ def wrap_wv(history, grid, params, alpha_method, order_alpha, F_method, verbose=
                                            alpha_method,
                                            order_alpha,
                                            F_method,
-                                           verbose)
+                                           verbose,
+                                           interp_backend,
+                                           interp_workers,
+                                           alpha_tol,
+                                           alpha_solver,
+                                           alpha_stats,
+                                           decomposition=decomposition)
     print("      us vs done") if verbose > 2 else None
     
     new_dz = outvar[0]
@@ -49,10 +70,16 @@ def wrap_wv(history, grid, params, alpha_method, order_alpha, F_method, verbose=
     #UPDATE OF W ---------------------------------------------------
     k_hour = int(3600/dt)
     if ((np.floor(cur_state.t/dt)-1)%k_hour==0 ):
-        cur_w = vertwind(grid.Lx, grid.Ly, cur_state.vrs['theta_t'], pre_state.vrs['theta_t'], dt, params, z=params['z_star'])
-        new_w = vertwind(grid.Lx, grid.Ly, new_state.vrs['theta_t'], cur_state.vrs['theta_t'], dt, params, z=params['z_star'])
+        # the spectra are memoized in the states: each theta_t is transformed only once
+        pre_hat = state_spectrum(pre_state, 'theta_t', backend=fft_backend)
+        cur_hat = state_spectrum(cur_state, 'theta_t', backend=fft_backend)
+        new_hat = state_spectrum(new_state, 'theta_t', backend=fft_backend)
+        cur_w = vertwind(grid.Lx, grid.Ly, cur_state.vrs['theta_t'], pre_state.vrs['theta_t'], dt, params, z=params['z_star'],
+                         thetatphat=cur_hat, thetatpprevhat=pre_hat, backend=fft_backend)
+        new_w = vertwind(grid.Lx, grid.Ly, new_state.vrs['theta_t'], cur_state.vrs['theta_t'], dt, params, z=params['z_star'],
+                         thetatphat=new_hat, thetatpprevhat=cur_hat, backend=fft_backend)
         mean_w = (cur_w + new_w)/2.
-        cur_state.vrs['Delta_z'] += k_hour * dt * mean_w
+        cur_state.vrs['Delta_z'] = cur_state.vrs['Delta_z'] + k_hour * dt * mean_w
         new_dz += k_hour * dt * mean_w
         
     dT_disp = params['gamma_2'] * cur_state.vrs['Delta_z']
@@ -66,3 +93,6 @@ def wrap_wv(history, grid, params, alpha_method, order_alpha, F_method, verbose=
     new_state.vrs['Delta_T_hist'] = new_dT_hist
     
     cur_state.vrs['Delta_T_bb'] = dT_bb
+
+# variables read or written by the method (see the load_variables argument of Simulation)
+wrap_wv.variables = ['theta_t', 'us', 'vs', 'alpha_us', 'alpha_vs', 'Delta_z', 'Delta_T_hist', 'Delta_T_bb']
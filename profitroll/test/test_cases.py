@@ -1,7 +1,7 @@
 import numpy as np
 from netCDF4 import Dataset
 
-def create_initial_netcdf(path, Lx, Ly, Nx, Ny, dt, nb_state):
+def create_initial_netcdf(path, Lx, Ly, Nx, Ny, dt, nb_state, precision='float64'):
     """Creates an initial NetCDF for test cases of tropopause intrusion evolution.
 
     :param path: path where the NetCDF file will be created
@@ -14,6 +14,8 @@ def create_initial_netcdf(path, Lx, Ly, Nx, Ny, dt, nb_state):
     :type Nx: int
     :param Ny: Vertical number of cells of the grid
     :type Ny: int
+    :param precision: 'float64' or 'float32', floating point type of the fields, defaults to 'float64'
+    :type precision: str, optional
     :return: The created dataset
     :rtype: Dataset at NETCDF4 format
     """
@@ -48,22 +50,23 @@ def create_initial_netcdf(path, Lx, Ly, Nx, Ny, dt, nb_state):
     handle.theta_00 = 300
 
 #VARIABLES --------------------------------------------------------------------
-    # "f8" is a data type: 64-bit floating point variable
-    handle.createVariable("ut", "f8", ("Nx", "Ny", "Nt"))
-    handle.createVariable("vt", "f8", ("Nx", "Ny", "Nt"))
-    handle.createVariable("us", "f8", ("Nx", "Ny", "Nt"))
-    handle.createVariable("vs", "f8", ("Nx", "Ny", "Nt"))
-    handle.createVariable("w", "f8", ("Nx", "Ny", "Nt"))
+    # "f8" is a data type: 64-bit floating point variable ("f4": 32-bit)
+    ft = np.dtype(precision).str[1:]
+    handle.createVariable("ut", ft, ("Nx", "Ny", "Nt"))
+    handle.createVariable("vt", ft, ("Nx", "Ny", "Nt"))
+    handle.createVariable("us", ft, ("Nx", "Ny", "Nt"))
+    handle.createVariable("vs", ft, ("Nx", "Ny", "Nt"))
+    handle.createVariable("w", ft, ("Nx", "Ny", "Nt"))
 
-    handle.createVariable("theta_t", "f8", ("Nx", "Ny", "Nt"))
-    handle.createVariable("Delta_T_bb", "f8", ("Nx", "Ny", "Nt"))
-    handle.createVariable("Delta_T_hist", "f8", ("Nx", "Ny", "Nt"))
-    handle.createVariable("Delta_z", "f8", ("Nx", "Ny", "Nt"))
+    handle.createVariable("theta_t", ft, ("Nx", "Ny", "Nt"))
+    handle.createVariable("Delta_T_bb", ft, ("Nx", "Ny", "Nt"))
+    handle.createVariable("Delta_T_hist", ft, ("Nx", "Ny", "Nt"))
+    handle.createVariable("Delta_z", ft, ("Nx", "Ny", "Nt"))
     
-    handle.createVariable("alpha_ut", "f8", ("Nx", "Ny", "Nt"))
-    handle.createVariable("alpha_vt", "f8", ("Nx", "Ny", "Nt"))
-    handle.createVariable("alpha_us", "f8", ("Nx", "Ny", "Nt"))
-    handle.createVariable("alpha_vs", "f8", ("Nx", "Ny", "Nt"))
+    handle.createVariable("alpha_ut", ft, ("Nx", "Ny", "Nt"))
+    handle.createVariable("alpha_vt", ft, ("Nx", "Ny", "Nt"))
+    handle.createVariable("alpha_us", ft, ("Nx", "Ny", "Nt"))
+    handle.createVariable("alpha_vs", ft, ("Nx", "Ny", "Nt"))
     
     handle.createVariable("t", "f8", ("Nt"))
     handle.createVariable("x_grid", "f8", ("Nx", "Ny"))
@@ -80,7 +83,7 @@ def create_initial_netcdf(path, Lx, Ly, Nx, Ny, dt, nb_state):
     return handle
 
 
-def v_stripe_test(path, Lx, Ly, Nx, Ny, dt, nb_state, dX, dY, depth=15):
+def v_stripe_test(path, Lx, Ly, Nx, Ny, dt, nb_state, dX, dY, depth=15, precision='float64'):
     """ V stripe (intrusion) test case
 
     :param path: path where the NetCDF file will be created
@@ -103,11 +106,13 @@ def v_stripe_test(path, Lx, Ly, Nx, Ny, dt, nb_state, dX, dY, depth=15):
     :type dY: int
     :param depth: Depth of the v stripe, default to 15
     :type depth: float, optional
+    :param precision: see :func:`create_initial_netcdf`, defaults to 'float64'
+    :type precision: str, optional
     :return: The created dataset
     :rtype: Dataset at NETCDF4 format
     """
     
-    handle = create_initial_netcdf(path, Lx, Ly, Nx, Ny, dt, nb_state)
+    handle = create_initial_netcdf(path, Lx, Ly, Nx, Ny, dt, nb_state, precision)
 
 #INITIALIZATION ---------------------------------------------------------------
         
@@ -162,7 +167,7 @@ def v_stripe_test(path, Lx, Ly, Nx, Ny, dt, nb_state, dX, dY, depth=15):
 
 #------------------------------------------------------------------------------
 
-def bubble_test(path, Lx, Ly, Nx, Ny, dt, nb_state, cx, cy, radius):
+def bubble_test(path, Lx, Ly, Nx, Ny, dt, nb_state, cx, cy, radius, precision='float64'):
     """ Bubble test case (circular intrusion)
 
     :param path: path where the NetCDF file will be created
@@ -185,10 +190,12 @@ def bubble_test(path, Lx, Ly, Nx, Ny, dt, nb_state, cx, cy, radius):
     :type cy: int
     :param radius: Radius of the circular intrusion
     :type radius: float
+    :param precision: see :func:`create_initial_netcdf`, defaults to 'float64'
+    :type precision: str, optional
     :return: The created dataset
     :rtype: Dataset at NETCDF4 format
     """    
-    handle = create_initial_netcdf(path, Lx, Ly, Nx, Ny, dt, nb_state)
+    handle = create_initial_netcdf(path, Lx, Ly, Nx, Ny, dt, nb_state, precision)
         
     #Bubble creation
     bubble_indices = np.where ((handle['x_grid'][:,:] - cx)**2 +
@@ -213,7 +220,7 @@ def bubble_test(path, Lx, Ly, Nx, Ny, dt, nb_state, cx, cy, radius):
 
 #------------------------------------------------------------------------------
 
-def gaussian_test(path, Lx, Ly, Nx, Ny, dt, nb_state):
+def gaussian_test(path, Lx, Ly, Nx, Ny, dt, nb_state, precision='float64'):
     """ Gaussian (intrusion) test case of fixed variance Px=8 (horizontal) and Py=64 (vertical)
 
     :param path: path where the NetCDF file will be created
@@ -230,10 +237,12 @@ def gaussian_test(path, Lx, Ly, Nx, Ny, dt, nb_state):
     :type dt: float
     :param nb_state: Number of created steps (same)
     :type nb_state: int
+    :param precision: see :func:`create_initial_netcdf`, defaults to 'float64'
+    :type precision: str, optional
     :return: The created dataset
     :rtype: Dataset at NETCDF4 format
     """  
-    handle = create_initial_netcdf(path, Lx, Ly, Nx, Ny, dt, nb_state)
+    handle = create_initial_netcdf(path, Lx, Ly, Nx, Ny, dt, nb_state, precision)
      
     #Gaussian creation
     thetatp = np.zeros((Nx, Ny))
@@ -263,3 +272,37 @@ def gaussian_test(path, Lx, Ly, Nx, Ny, dt, nb_state):
     return handle
     
 #------------------------------------------------------------------------------
+
+def ensemble_test(path, members):
+    """ Gathers several initial NetCDF files (created by the test cases above, with the same grid, time steps and
+    parameters) into the initial file of an ensemble of simulations. The fields get a leading dimension Ne, each
+    member being advanced by the same :class:`Simulation`.
+
+    :param path: path where the NetCDF file will be created
+    :type path: str
+    :param members: Initial files of the members (they are closed)
+    :type members: list of Dataset at NETCDF4 format
+    :return: The created dataset
+    :rtype: Dataset at NETCDF4 format
+    """
+    first = members[0]
+    handle = Dataset(path, 'w', format='NETCDF4')
+
+    for name, dim in first.dimensions.items():
+        handle.createDimension(name, dim.size)
+    handle.createDimension("Ne", len(members))
+    handle.setncatts({at: first.getncattr(at) for at in first.ncattrs()})
+
+    for var in first.variables:
+        if first[var].dimensions == ("Nx", "Ny", "Nt"):
+            handle.createVariable(var, first[var].dtype, ("Ne", "Nx", "Ny", "Nt"))
+            handle[var][:] = np.stack([member[var][:].data for member in members])
+        else:
+            handle.createVariable(var, first[var].dtype, first[var].dimensions)
+            handle[var][:] = first[var][:]
+
+    for member in members:
+        member.close()
+    return handle
+
+#------------------------------------------------------------------------------